@@ -2,9 +2,21 @@ import os
 from datetime import datetime
 import zipfile
 from werkzeug.utils import secure_filename
+from werkzeug.serving import is_running_from_reloader
 import threading
 import time
+import asyncio
 import json
+import hashlib
+import hmac
+import secrets
+import zlib
+import base64
+import csv
+import io
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 
 from flask import (
     Flask,
@@ -13,12 +25,22 @@ from flask import (
     redirect,
     url_for,
     session,
-    flash
+    flash,
+    jsonify,
+    Response,
+    stream_with_context,
 )
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text, event, inspect as sa_inspect
+from sqlalchemy.exc import IntegrityError
+import click
 from functools import wraps
 
-from utils.terraform_runner import (run_terraform_template_job,run_terraform_custom_job,run_terraform_destroy_job)
+from utils.terraform_runner import (arun_terraform_template_job,arun_terraform_custom_job,arun_terraform_destroy_job,aresume_terraform_job,arun_terraform_drift_check,JobControl,run_sync,submit)
+from utils.terraform_runner import template_content_hash, zip_content_hash, avalidate_terraform_config
+from utils.dag import topological_order, arun_dag
+from utils.governor import ConcurrencyGovernor
+from utils.resources import MemoryAdmission
 # -------------------------
 # Flask App Setup
 # -------------------------
@@ -30,7 +52,7 @@ app.config["SECRET_KEY"] = "super-secret-key-change-this"
 
 # SQLite DB config
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DB_PATH = os.path.join(BASE_DIR, "cloudinfra.db")
+DB_PATH = os.environ.get("CLOUDINFRA_DB_PATH") or os.path.join(BASE_DIR, "cloudinfra.db")
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + DB_PATH
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
@@ -45,148 +67,2128 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 app.config["MAX_CONTENT_LENGTH"] = 50 * 1024 * 1024
 
+# Batch deploys: upper bound on jobs per group and on parallel jobs per group
+app.config["BATCH_MAX_JOBS"] = 100
+app.config["BATCH_MAX_CONCURRENCY"] = 10
+
+# Per-phase Terraform timeouts in seconds, with per-template overrides.
+# A phase that runs longer is interrupted and the job ends as "TimedOut".
+app.config["TERRAFORM_PHASE_TIMEOUTS"] = {
+    "init": 15 * 60,
+    "apply": 60 * 60,
+    "output": 2 * 60,
+    "destroy": 60 * 60,
+    "drift": 20 * 60,
+    "preflight_init": 15 * 60,
+    "validate": 5 * 60,
+    "fmt": 2 * 60,
+}
+app.config["TEMPLATE_PHASE_TIMEOUTS"] = {
+    "eks_basic": {"apply": 90 * 60, "destroy": 90 * 60},
+    "s3_cloudfront": {"apply": 75 * 60, "destroy": 75 * 60},
+}
+
+# Built-in Terraform HTTP state backend. Job workspaces are pointed at
+# <STATE_BACKEND_URL>/tfstate/job_<id>, so state lives in this database
+# instead of a local terraform.tfstate on whichever node ran the job.
+app.config["STATE_BACKEND_ENABLED"] = os.environ.get("CLOUDINFRA_STATE_BACKEND", "1") == "1"
+app.config["STATE_BACKEND_URL"] = os.environ.get("CLOUDINFRA_URL", "http://127.0.0.1:5000")
+app.config["STATE_HISTORY_LIMIT"] = 20
+
+# Workspaces authenticate to the state backend with an HMAC of the state name.
+# Its key is CLOUDINFRA_STATE_SECRET, or a random one generated on first start
+# and kept in STATE_SECRET_PATH -- never the (shared, often default) SECRET_KEY.
+STATE_SECRET_PATH = os.path.join(BASE_DIR, ".state_secret")
+
+
+def load_state_secret():
+    secret = os.environ.get("CLOUDINFRA_STATE_SECRET")
+    if secret:
+        return secret
+
+    try:
+        # O_EXCL: with several workers starting at once, exactly one writes the file
+        fd = os.open(STATE_SECRET_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50):
+            with open(STATE_SECRET_PATH, "r") as f:
+                secret = f.read().strip()
+            if secret:
+                return secret
+            time.sleep(0.1)  # another worker is still writing it
+        raise RuntimeError(f"State backend secret file {STATE_SECRET_PATH} is empty")
+
+    secret = secrets.token_hex(32)
+    with os.fdopen(fd, "w") as f:
+        f.write(secret)
+    return secret
+
+
+app.config["STATE_SECRET"] = load_state_secret()
+
+# Drift detection: `plan -refresh-only` over live jobs. Jobs checked within
+# DRIFT_RECHECK_SECONDS are skipped. With DRIFT_SCAN_INTERVAL_SECONDS > 0 and
+# AWS credentials in the environment, all live jobs are scanned periodically.
+app.config["DRIFT_MAX_WORKERS"] = 4
+app.config["DRIFT_RECHECK_SECONDS"] = 6 * 60 * 60
+app.config["DRIFT_SCAN_INTERVAL_SECONDS"] = int(os.environ.get("CLOUDINFRA_DRIFT_INTERVAL", "0"))
+
+# Concurrency governor: Terraform runs sharing one AWS access key + region
+# share one API rate limit. Each such group gets at most
+# GOVERNOR_MAX_ACTIVE concurrent runs; throttling errors in a run's output
+# halve the group's limit and -parallelism, clean runs grow them back.
+app.config["GOVERNOR_MAX_ACTIVE"] = 3
+app.config["GOVERNOR_MAX_PARALLELISM"] = 10
+app.config["GOVERNOR_MIN_PARALLELISM"] = 2
+
+# Per-user status / template counters are updated on every job status change;
+# a reconciliation pass rebuilds them from the Job table this often.
+app.config["JOB_COUNTS_RECONCILE_SECONDS"] = 10 * 60
+
+# Users who see fleet-wide numbers (comma-separated emails)
+app.config["ADMIN_EMAILS"] = {
+    email.strip()
+    for email in os.environ.get("CLOUDINFRA_ADMIN_EMAILS", "admin@example.com").split(",")
+    if email.strip()
+}
+
+# Pre-flight validation: `terraform validate` runs once per unique template /
+# upload content hash; the verdict is cached in ValidationResult. Content
+# known to be broken is rejected at submit, known-good content skips the check.
+# With CLOUDINFRA_VALIDATE_FMT=1, `terraform fmt -check` must pass as well.
+app.config["VALIDATE_FMT_CHECK"] = os.environ.get("CLOUDINFRA_VALIDATE_FMT", "0") == "1"
+
+# Job history export streams jobs in keyset-paginated batches of this size;
+# each batch is its own short read transaction.
+app.config["EXPORT_BATCH_SIZE"] = 500
+
+# Memory admission: a run starts only while projected host memory (in use
+# now + expected growth of admitted runs + this run's expected peak) stays
+# under ADMISSION_MEMORY_LIMIT_PERCENT of the host. Expected peaks come from
+# each template's recorded profile (EWMA of peak RSS x headroom), or
+# ADMISSION_DEFAULT_JOB_MB for templates without history. 0 disables it.
+app.config["ADMISSION_MEMORY_LIMIT_PERCENT"] = int(os.environ.get("CLOUDINFRA_MEMORY_LIMIT_PERCENT", "85"))
+app.config["ADMISSION_DEFAULT_JOB_MB"] = 512
+app.config["ADMISSION_HEADROOM"] = 1.2
+app.config["RESOURCE_PROFILE_EWMA_WEIGHT"] = 0.3
+
+# Failures classified as transient (throttling, network) are resumed
+# automatically from the failed phase, with exponential backoff.
+app.config["RETRY_MAX_AUTO_ATTEMPTS"] = 3
+app.config["RETRY_BACKOFF_SECONDS"] = 20
+
 db = SQLAlchemy(app)
 
-# -------------------------
-# Database Models
-# -------------------------
+# -------------------------
+# Database Models
+# -------------------------
+
+class User(db.Model):
+    """
+    Very simple user model for now.
+    Future: proper password hashing + registration system.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password = db.Column(db.String(128), nullable=False)  # plain for now (NOT for production)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Job(db.Model):
+    """
+    Deployment Job model – template/custom mode, status, logs path etc.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+
+    mode = db.Column(db.String(20), nullable=False)  # "template" / "custom"
+    template_name = db.Column(db.String(100), nullable=True)
+
+    status = db.Column(db.String(20), default="Pending")  # Pending / Queued / Running / Success / Failed / Destroyed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    log_file_path = db.Column(db.String(255), nullable=True)
+
+    # NEW: store full terraform outputs as JSON string
+    outputs_json = db.Column(db.Text, nullable=True)
+
+    # NEW: a single main output to quickly show on dashboard
+    primary_output = db.Column(db.String(255), nullable=True)
+
+    # Region the job was deployed to (batch deploys fan out across regions)
+    aws_region = db.Column(db.String(30), nullable=True)
+
+    # Set when the job was created as part of a batch deploy
+    group_id = db.Column(db.Integer, db.ForeignKey("job_group.id"), nullable=True, index=True)
+
+    # Set when the job is one node of a stack (dependency graph of templates)
+    stack_id = db.Column(db.Integer, db.ForeignKey("stack.id"), nullable=True, index=True)
+    stack_node = db.Column(db.String(100), nullable=True)
+
+    # Phase that failed ("init" / "apply") – a retry resumes from here
+    failed_phase = db.Column(db.String(20), nullable=True)
+    attempts = db.Column(db.Integer, default=1)
+
+    # Terraform variables of a template job, so its workspace can be rebuilt
+    # on another node (state itself lives in TerraformState)
+    variables_json = db.Column(db.Text, nullable=True)
+
+    # Resource profile of the job's terraform process trees (apply + retries)
+    peak_rss_mb = db.Column(db.Float, nullable=True)
+    peak_cpu_percent = db.Column(db.Float, nullable=True)
+    cpu_seconds = db.Column(db.Float, nullable=True)
+
+    # Set once Terraform has been started in the job's workspace; only such
+    # jobs have anything to destroy
+    workspace_created = db.Column(db.Boolean, default=False)
+
+    # sha256 of the template folder / uploaded ZIP contents (pre-flight cache key)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
+
+    # Fingerprint of the AWS access key the job was deployed with. Drift checks
+    # only run with that same key: any other account sees every resource as deleted.
+    credential_fingerprint = db.Column(db.String(12), nullable=True, index=True)
+
+    # Result of the latest drift check: InSync / Drifted / Error
+    drift_status = db.Column(db.String(20), nullable=True)
+    drift_checked_at = db.Column(db.DateTime, nullable=True, index=True)
+
+
+class JobGroup(db.Model):
+    """
+    A batch of template jobs created from one template + a matrix of
+    variable sets / regions. Jobs in a group run with bounded concurrency.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    template_name = db.Column(db.String(100), nullable=False)
+    max_concurrency = db.Column(db.Integer, default=4)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    jobs = db.relationship("Job", backref="group", lazy="dynamic")
+
+
+class Stack(db.Model):
+    """
+    A set of template jobs with dependencies between them. Upstream outputs
+    are mapped to downstream Terraform variables; see deploy_stack().
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    # Normalized node definitions: {node: {template_id, aws_region, depends_on, inputs}}
+    definition_json = db.Column(db.Text, nullable=False)
+    max_concurrency = db.Column(db.Integer, default=4)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    jobs = db.relationship("Job", backref="stack", lazy="dynamic")
+
+
+class JobOutput(db.Model):
+    """
+    Terraform outputs of a job, one row per output plus one row per element
+    of list / map outputs, so outputs can be searched by name or value
+    without parsing every job's outputs_json.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey("job.id"), nullable=False, index=True)
+    name = db.Column(db.String(255), nullable=False)
+
+    # None for the output itself; list index / map key for its elements
+    item_key = db.Column(db.String(255), nullable=True)
+
+    # Scalar value as text (indexed). None for sensitive or nested values.
+    value = db.Column(db.String(1024), nullable=True, index=True)
+
+    # Full value + type as JSON, on the output's own row only
+    value_json = db.Column(db.Text, nullable=True)
+    type_json = db.Column(db.Text, nullable=True)
+    sensitive = db.Column(db.Boolean, default=False)
+
+    __table_args__ = (db.Index("ix_job_output_name_value", "name", "value"),)
+
+
+class TerraformState(db.Model):
+    """
+    Versioned Terraform state served by the built-in HTTP backend.
+    Every write is a new version; `data` is the zlib-compressed state JSON.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False)
+    serial = db.Column(db.Integer, nullable=True)
+    md5 = db.Column(db.String(32), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint("name", "version"),)
+
+
+class TerraformStateLock(db.Model):
+    """
+    Lock held by a Terraform run on a state (LOCK / UNLOCK of the HTTP backend).
+    """
+    name = db.Column(db.String(100), primary_key=True)
+    lock_id = db.Column(db.String(64), nullable=False)
+    info_json = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class DriftCheck(db.Model):
+    """
+    One drift check of a live job (`terraform plan -refresh-only`).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey("job.id"), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False)  # InSync / Drifted / Error
+    changed_json = db.Column(db.Text, nullable=True)  # resource addresses that drifted
+    log_file_path = db.Column(db.String(255), nullable=True)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class TemplateResourceProfile(db.Model):
+    """
+    Historical resource usage of one template's runs ("" = custom jobs),
+    used for memory admission and capacity planning.
+    """
+    template_name = db.Column(db.String(100), primary_key=True)
+    runs = db.Column(db.Integer, nullable=False, default=0)
+    ewma_peak_rss_mb = db.Column(db.Float, nullable=False, default=0.0)
+    max_peak_rss_mb = db.Column(db.Float, nullable=False, default=0.0)
+    max_cpu_percent = db.Column(db.Float, nullable=False, default=0.0)
+    avg_cpu_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ValidationResult(db.Model):
+    """
+    Cached pre-flight verdict (`terraform validate`, optionally `fmt -check`)
+    for one template / upload content hash.
+    """
+    content_hash = db.Column(db.String(64), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # template / custom
+    label = db.Column(db.String(255), nullable=True)  # template name or upload filename
+    validate_ok = db.Column(db.Boolean, nullable=False)
+    fmt_ok = db.Column(db.Boolean, nullable=True)  # None = formatting not checked
+    output = db.Column(db.Text, nullable=True)  # tail of the validation log
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class JobEvent(db.Model):
+    """
+    Timeline of a job: every status transition (kind "status") and every
+    Terraform command it ran (kind "phase", with duration and exit code).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey("job.id"), nullable=False, index=True)
+    kind = db.Column(db.String(10), nullable=False)  # status / phase
+    name = db.Column(db.String(30), nullable=False)  # new status, or phase name
+    at = db.Column(db.DateTime, default=datetime.utcnow)
+    duration_seconds = db.Column(db.Float, nullable=True)
+    exit_code = db.Column(db.Integer, nullable=True)
+
+    job = db.relationship("Job")
+
+
+@event.listens_for(db.session, "before_flush")
+def record_status_transitions(session, flush_context, instances):
+    """
+    Add a "status" JobEvent for every Job whose status changes in this flush,
+    wherever in the app the status was set.
+    """
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Job) or not obj.status:
+            continue
+        if obj in session.new or sa_inspect(obj).attrs.status.history.has_changes():
+            session.add(JobEvent(job=obj, kind="status", name=obj.status))
+
+
+class JobStatusCount(db.Model):
+    """
+    Number of jobs per (user, template, status), kept current on every status
+    change so summaries never have to count the Job table.
+    template_name is "" for custom jobs.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    template_name = db.Column(db.String(100), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+UPSERT_STATUS_COUNT = text(
+    "INSERT INTO job_status_count (user_id, template_name, status, count) "
+    "VALUES (:user_id, :template_name, :status, :delta) "
+    "ON CONFLICT (user_id, template_name, status) "
+    "DO UPDATE SET count = count + excluded.count"
+)
+
+
+@event.listens_for(db.session, "before_flush")
+def update_status_counts(session, flush_context, instances):
+    """
+    Move jobs between JobStatusCount buckets in the same transaction as the
+    status change itself.
+    """
+    deltas = {}
+    connection = session.connection()
+
+    def bump(job, status, delta):
+        key = (job.user_id, job.template_name or "", status or "Pending")
+        deltas[key] = deltas.get(key, 0) + delta
+
+    def stored_status(job):
+        # The previous value is not in the history when the status was set on
+        # an expired instance (e.g. right after a commit); read it from the row.
+        history = sa_inspect(job).attrs.status.history
+        if history.deleted:
+            return history.deleted[0]
+        return connection.execute(text("SELECT status FROM job WHERE id = :id"), {"id": job.id}).scalar()
+
+    for obj in session.new:
+        if isinstance(obj, Job):
+            bump(obj, obj.status, 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Job):
+            bump(obj, stored_status(obj), -1)
+
+    for obj in session.dirty:
+        if not isinstance(obj, Job) or obj in session.new:
+            continue
+        added = sa_inspect(obj).attrs.status.history.added
+        if not added:
+            continue
+        previous = stored_status(obj)
+        if previous != added[0]:
+            bump(obj, previous, -1)
+            bump(obj, added[0], 1)
+
+    for (user_id, template_name, status), delta in deltas.items():
+        if delta:
+            connection.execute(UPSERT_STATUS_COUNT, {
+                "user_id": user_id, "template_name": template_name, "status": status, "delta": delta,
+            })
+
+
+def reconcile_job_counts():
+    """
+    Rebuild JobStatusCount from the Job table (catches anything changed
+    outside the ORM). The DELETE takes SQLite's write lock first, so no
+    status change can slip in between counting and writing.
+
+    Returns the number of (user, template, status) buckets that were wrong.
+    """
+    before = {
+        (row.user_id, row.template_name, row.status): row.count
+        for row in JobStatusCount.query.filter(JobStatusCount.count != 0)
+    }
+
+    db.session.execute(text("DELETE FROM job_status_count"))
+    db.session.execute(text(
+        "INSERT INTO job_status_count (user_id, template_name, status, count) "
+        "SELECT user_id, COALESCE(template_name, ''), COALESCE(status, 'Pending'), COUNT(*) "
+        "FROM job GROUP BY 1, 2, 3"
+    ))
+    db.session.commit()
+
+    after = {
+        (row.user_id, row.template_name, row.status): row.count
+        for row in JobStatusCount.query
+    }
+    return sum(1 for key in set(before) | set(after) if before.get(key) != after.get(key))
+
+
+def job_counts_reconcile_loop():
+    interval = app.config["JOB_COUNTS_RECONCILE_SECONDS"]
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                corrected = reconcile_job_counts()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Job count reconciliation failed")
+                continue
+        if corrected:
+            app.logger.warning("Job count reconciliation corrected %d bucket(s)", corrected)
+
+
+def start_job_counts_reconciler():
+    if app.config["JOB_COUNTS_RECONCILE_SECONDS"] <= 0:
+        return
+    threading.Thread(target=job_counts_reconcile_loop, daemon=True, name="job-counts").start()
+
+
+def job_counts_summary(user_id=None):
+    """
+    Status totals from JobStatusCount, for one user or (user_id=None) the fleet.
+    """
+    query = db.session.query(
+        JobStatusCount.template_name, JobStatusCount.status, db.func.sum(JobStatusCount.count),
+    ).filter(JobStatusCount.count != 0)
+    if user_id is not None:
+        query = query.filter(JobStatusCount.user_id == user_id)
+    query = query.group_by(JobStatusCount.template_name, JobStatusCount.status)
+
+    by_status = {}
+    by_template = {}
+    for template_name, status, count in query:
+        template = template_name or "custom"
+        by_status[status] = by_status.get(status, 0) + count
+        by_template.setdefault(template, {})[status] = count
+
+    return {
+        "total": sum(by_status.values()),
+        "active": sum(by_status.get(status, 0) for status in ("Queued", "Running", "Destroying")),
+        "by_status": by_status,
+        "by_template": by_template,
+    }
+
+
+def record_phase_timings(job, control):
+    """
+    Store the Terraform commands a run executed as "phase" JobEvents.
+    """
+    for timing in control.phase_timings:
+        db.session.add(JobEvent(
+            job_id=job.id,
+            kind="phase",
+            name=timing["phase"],
+            at=datetime.utcfromtimestamp(timing["started_at"]),
+            duration_seconds=timing["duration_seconds"],
+            exit_code=timing["exit_code"],
+        ))
+    control.phase_timings = []
+
+
+# -------------------------
+# Template Variables
+# -------------------------
+
+AVAILABLE_TEMPLATES = [
+    {"id": "web_server", "label": "Web Server – Single EC2 Instance"},
+    {"id": "vpc_basic", "label": "VPC – Public/Private Subnets"},
+    {"id": "s3_cloudfront", "label": "Static Website – S3 + CloudFront"},
+    {"id": "two_tier_app", "label": "Two-Tier App – EC2 + RDS"},
+    {"id": "eks_basic", "label": "EKS Cluster – Basic Managed Node Group"},
+    {"id": "alb_asg", "label": "ALB + ASG – Highly Available Web App"},
+    {"id": "secure_web_hosting", "label": "Secure Web Hosting – Hardened EC2 Web Server"},
+]
+
+
+def _field(fields, name):
+    value = fields.get(name)
+    return "" if value is None else str(value).strip()
+
+
+def build_template_vars(template_id, fields, aws_region):
+    """
+    Validate the form fields for a template and map them to Terraform variables.
+
+    `fields` is anything with a dict-like .get() (request.form, or a plain dict
+    for batch deploys).
+
+    Returns:
+        (tf_vars: dict | None, error: str | None)
+    """
+    # Collect template specific fields
+    instance_name = _field(fields, "instance_name")
+    key_pair_name = _field(fields, "key_pair_name")
+
+    vpc_cidr = _field(fields, "vpc_cidr")
+    public_subnet_1_cidr = _field(fields, "public_subnet_1_cidr")
+    public_subnet_2_cidr = _field(fields, "public_subnet_2_cidr")
+    private_subnet_1_cidr = _field(fields, "private_subnet_1_cidr")
+    private_subnet_2_cidr = _field(fields, "private_subnet_2_cidr")
+
+    s3_bucket_name = _field(fields, "s3_bucket_name")
+
+    # Per-template validation + mapping
+    if template_id == "web_server":
+        if not instance_name or not key_pair_name:
+            return None, "Instance name and key pair are required for Web Server template."
+
+        return {
+            "instance_name": instance_name,
+            "key_pair_name": key_pair_name,
+            "aws_region": aws_region,
+        }, None
+
+    elif template_id == "vpc_basic":
+        required_vpc_fields = [
+            vpc_cidr,
+            public_subnet_1_cidr,
+            public_subnet_2_cidr,
+            private_subnet_1_cidr,
+            private_subnet_2_cidr,
+        ]
+        if not all(required_vpc_fields):
+            return None, "All VPC and subnet CIDRs are required for VPC template."
+
+        return {
+            "aws_region": aws_region,
+            "vpc_cidr": vpc_cidr,
+            "public_subnet_1_cidr": public_subnet_1_cidr,
+            "public_subnet_2_cidr": public_subnet_2_cidr,
+            "private_subnet_1_cidr": private_subnet_1_cidr,
+            "private_subnet_2_cidr": private_subnet_2_cidr,
+        }, None
+
+    elif template_id == "s3_cloudfront":
+        if not s3_bucket_name:
+            return None, "Bucket name is required for S3 + CloudFront template."
+
+        return {
+            "aws_region": aws_region,
+            "bucket_name": s3_bucket_name,
+        }, None
+
+    elif template_id == "two_tier_app":
+        if not instance_name or not key_pair_name:
+            return None, "Instance name and key pair are required for Two-Tier App template."
+
+        db_name = _field(fields, "db_name")
+        db_username = _field(fields, "db_username")
+        db_password = _field(fields, "db_password")
+
+        if not db_name or not db_username or not db_password:
+            return None, "DB name, username, and password are required for Two-Tier App template."
+
+        return {
+            "aws_region": aws_region,
+            "instance_name": instance_name,
+            "key_pair_name": key_pair_name,
+            "db_name": db_name,
+            "db_username": db_username,
+            "db_password": db_password,
+        }, None
+
+    elif template_id == "eks_basic":
+        cluster_name = _field(fields, "eks_cluster_name")
+        node_instance_type = _field(fields, "eks_node_instance_type")
+        desired_size = _field(fields, "eks_desired_size")
+        min_size = _field(fields, "eks_min_size")
+        max_size = _field(fields, "eks_max_size")
+
+        if not cluster_name:
+            return None, "Cluster name is required for EKS template."
+
+        if not node_instance_type:
+            node_instance_type = "t3.small"
+
+        # Basic check for scaling numbers
+        if not (desired_size and min_size and max_size):
+            return None, "Desired, min, and max node counts are required for EKS template."
+
+        try:
+            desired_size = int(desired_size)
+            min_size = int(min_size)
+            max_size = int(max_size)
+        except ValueError:
+            return None, "EKS node sizes must be integers."
+
+        return {
+            "aws_region": aws_region,
+            "cluster_name": cluster_name,
+            "node_instance_type": node_instance_type,
+            "desired_size": desired_size,
+            "min_size": min_size,
+            "max_size": max_size,
+        }, None
+
+    elif template_id == "alb_asg":
+        # Reuse instance_name + key_pair_name fields
+        if not instance_name or not key_pair_name:
+            return None, "Instance name and key pair are required for ALB + ASG template."
+
+        asg_instance_type = _field(fields, "asg_instance_type") or "t2.micro"
+        asg_desired = _field(fields, "asg_desired_capacity")
+        asg_min = _field(fields, "asg_min_size")
+        asg_max = _field(fields, "asg_max_size")
+
+        if not (asg_desired and asg_min and asg_max):
+            return None, "ASG desired, min, and max sizes are required for ALB + ASG template."
+
+        try:
+            asg_desired = int(asg_desired)
+            asg_min = int(asg_min)
+            asg_max = int(asg_max)
+        except ValueError:
+            return None, "ASG sizes must be integers."
+
+        return {
+            "aws_region": aws_region,
+            "instance_name": instance_name,
+            "key_pair_name": key_pair_name,
+            "asg_instance_type": asg_instance_type,
+            "asg_desired_capacity": asg_desired,
+            "asg_min_size": asg_min,
+            "asg_max_size": asg_max,
+        }, None
+
+    elif template_id == "secure_web_hosting":
+        if not instance_name or not key_pair_name:
+            return None, "Instance name and key pair are required for Secure Web Hosting template."
+
+        allowed_ssh_cidr = _field(fields, "allowed_ssh_cidr") or "0.0.0.0/0"
+        secure_instance_type = _field(fields, "secure_instance_type") or "t3.micro"
+
+        github_repo_url = _field(fields, "github_repo_url")
+        github_branch = _field(fields, "github_branch") or "main"
+        app_root_subdir = _field(fields, "app_root_subdir")
+        domain_name = _field(fields, "domain_name")
+
+        if not github_repo_url:
+            return None, "GitHub repository URL is required for Secure Web Hosting template."
+
+        if not domain_name:
+            return None, "Domain name is required for Secure Web Hosting template (it can be planned/future domain)."
+
+        return {
+            "aws_region": aws_region,
+            "instance_name": instance_name,
+            "key_pair_name": key_pair_name,
+            "allowed_ssh_cidr": allowed_ssh_cidr,
+            "instance_type": secure_instance_type,
+            "github_repo_url": github_repo_url,
+            "github_branch": github_branch,
+            "app_root_subdir": app_root_subdir,
+            "domain_name": domain_name,
+        }, None
+
+    return None, "Unknown template selected."
+
+
+# -------------------------
+# Running Job Controls (cancel / timeouts)
+# -------------------------
+
+# job_id -> JobControl of the terraform command currently running for it
+ACTIVE_JOBS = {}
+ACTIVE_JOBS_LOCK = threading.Lock()
+
+INTERRUPTED_STATUS = {"cancelled": "Cancelled", "timed_out": "TimedOut"}
+DESTROY_INTERRUPTED_STATUS = {"cancelled": "Destroy Cancelled", "timed_out": "Destroy TimedOut"}
+
+
+def phase_timeouts(template_name):
+    timeouts = dict(app.config["TERRAFORM_PHASE_TIMEOUTS"])
+    timeouts.update(app.config["TEMPLATE_PHASE_TIMEOUTS"].get(template_name, {}))
+    return timeouts
+
+
+GOVERNOR = ConcurrencyGovernor(
+    max_active=app.config["GOVERNOR_MAX_ACTIVE"],
+    max_parallelism=app.config["GOVERNOR_MAX_PARALLELISM"],
+    min_parallelism=app.config["GOVERNOR_MIN_PARALLELISM"],
+)
+
+
+MEMORY_ADMISSION = MemoryAdmission(limit_percent=app.config["ADMISSION_MEMORY_LIMIT_PERCENT"])
+
+
+def credential_fingerprint(aws_access_key):
+    return hashlib.sha256(aws_access_key.encode()).hexdigest()[:12]
+
+
+def governor_key(aws_access_key, aws_region):
+    return (credential_fingerprint(aws_access_key), aws_region)
+
+
+def expected_job_bytes(template_name):
+    """
+    Projected peak RSS of a run of this template, from its recorded profile.
+    """
+    profile = TemplateResourceProfile.query.get(template_name or "")
+    if profile is None or not profile.runs:
+        expected_mb = app.config["ADMISSION_DEFAULT_JOB_MB"]
+    else:
+        expected_mb = profile.ewma_peak_rss_mb * app.config["ADMISSION_HEADROOM"]
+    return int(expected_mb * 1024 * 1024)
+
+
+@asynccontextmanager
+async def agoverned_slot(control, aws_access_key, aws_region, template_name):
+    """
+    Hold a governor slot for (access key, region) and a memory admission for
+    the host while Terraform runs. The governor slot is taken first, so a run
+    waiting for it does not hold memory other credentials could use.
+    Both waits happen on the runner's event loop. Yields False if the job
+    was cancelled while waiting.
+    """
+    key = governor_key(aws_access_key, aws_region)
+    should_abort = lambda: control.cancel_requested
+    parallelism = await GOVERNOR.aacquire(key, should_abort=should_abort)
+    if parallelism is None:
+        yield False
+        return
+
+    control.parallelism = parallelism
+    control.throttled = False
+    commands_before = len(control.phase_timings)
+    try:
+        expected_bytes = await db_call(expected_job_bytes, template_name)
+        if not await MEMORY_ADMISSION.aacquire(control, expected_bytes, should_abort=should_abort):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            MEMORY_ADMISSION.release(control)
+    finally:
+        # Only a slot that actually ran Terraform says anything about the rate limit
+        ran = len(control.phase_timings) > commands_before
+        GOVERNOR.release(key, throttled=control.throttled if ran else None)
+
+
+# Job coroutines run on the runner's event loop; their database steps go
+# through this pool, each in its own app context, so the loop never waits on
+# SQLite. Not the loop's default executor: pre-flight validation waits here
+# for a runner coroutine that needs the default executor itself.
+JOB_STEP_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="job-step")
+
+
+async def db_call(fn, *args):
+    def call():
+        with app.app_context():
+            return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(JOB_STEP_EXECUTOR, call)
+
+
+def start_job_task(coro, label):
+    """
+    Start a job / group / stack coroutine on the runner's event loop and
+    return at once. A failure is logged when the task ends.
+    """
+    future = submit(coro)
+
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            app.logger.error("%s failed", label, exc_info=future.exception())
+
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def claim_job(job, control):
+    """
+    Queued -> Running once a slot is granted, unless cancelled meanwhile.
+    From here on the job has a workspace Terraform may have changed.
+    """
+    db.session.refresh(job)
+    if job.status != "Queued" or control.cancel_requested:
+        return False
+    job.status = "Running"
+    job.workspace_created = True
+    db.session.commit()
+    return True
+
+
+def state_token(name):
+    return hmac.new(app.config["STATE_SECRET"].encode(), name.encode(), hashlib.sha256).hexdigest()
+
+
+def state_backend_env(job_id):
+    """
+    TF_HTTP_* environment that points a job workspace at the built-in state
+    backend, or None when the backend is disabled.
+    """
+    if not app.config["STATE_BACKEND_ENABLED"]:
+        return None
+
+    name = f"job_{job_id}"
+    address = f"{app.config['STATE_BACKEND_URL'].rstrip('/')}/tfstate/{name}"
+    return {
+        "TF_HTTP_ADDRESS": address,
+        "TF_HTTP_LOCK_ADDRESS": address,
+        "TF_HTTP_UNLOCK_ADDRESS": address,
+        "TF_HTTP_USERNAME": name,
+        "TF_HTTP_PASSWORD": state_token(name),
+    }
+
+
+def release_state_lock(job_id):
+    """
+    Drop the backend lock of a job whose Terraform the engine interrupted:
+    a run killed after SIGINT never gets to UNLOCK. Caller commits.
+    """
+    TerraformStateLock.query.filter_by(name=f"job_{job_id}").delete()
+
+
+def release_stale_state_locks():
+    """
+    Terraform only runs as a child of this process's runner loop, so at startup
+    any lock on a job's state was left by a run that died with the last process.
+    """
+    TerraformStateLock.query.filter(TerraformStateLock.name.like("job\\_%", escape="\\")).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+
+
+def job_variables(job):
+    return json.loads(job.variables_json) if job.variables_json else None
+
+
+def start_job_control(job_id, template_name):
+    control = JobControl(timeouts=phase_timeouts(template_name))
+    with ACTIVE_JOBS_LOCK:
+        ACTIVE_JOBS[job_id] = control
+    return control
+
+
+def finish_job_control(job_id):
+    with ACTIVE_JOBS_LOCK:
+        ACTIVE_JOBS.pop(job_id, None)
+
+
+def record_job_outputs(job, outputs):
+    """
+    Store terraform outputs on the job and pick its primary_output.
+    """
+    if not outputs:
+        return
+
+    job.outputs_json = json.dumps(outputs)
+    store_job_outputs(job, outputs)
+    template_id = job.template_name
+
+    if job.mode == "custom":
+        # For generic custom projects, we don't know which is main,
+        # but we can pick the first key's value as primary_output
+        try:
+            first_key = next(iter(outputs))
+            val = outputs[first_key].get("value")
+            job.primary_output = str(val)
+        except Exception:
+            pass
+
+    # Primary output selection per template
+    elif template_id == "web_server":
+        ip = outputs.get("instance_public_ip", {}).get("value")
+        dns = outputs.get("instance_public_dns", {}).get("value")
+        job.primary_output = dns or ip
+
+    elif template_id == "vpc_basic":
+        vpc_id = outputs.get("vpc_id", {}).get("value")
+        job.primary_output = vpc_id
+
+    elif template_id == "s3_cloudfront":
+        cf_domain = outputs.get("cloudfront_domain_name", {}).get("value")
+        site_endpoint = outputs.get("website_endpoint", {}).get("value")
+        job.primary_output = cf_domain or site_endpoint
+
+    elif template_id == "two_tier_app":
+        web_dns = outputs.get("web_public_dns", {}).get("value")
+        web_ip = outputs.get("web_public_ip", {}).get("value")
+        job.primary_output = web_dns or web_ip
+
+    elif template_id == "eks_basic":
+        endpoint = outputs.get("cluster_endpoint", {}).get("value")
+        name = outputs.get("cluster_name", {}).get("value")
+        job.primary_output = endpoint or name
+
+    elif template_id == "alb_asg":
+        alb_dns = outputs.get("alb_dns_name", {}).get("value")
+        job.primary_output = alb_dns
+
+    elif template_id == "secure_web_hosting":
+        ip = outputs.get("instance_public_ip", {}).get("value")
+        dns = outputs.get("instance_public_dns", {}).get("value")
+        job.primary_output = dns or ip
+
+
+def _output_text(value):
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)[:1024]
+
+
+def store_job_outputs(job, outputs):
+    """
+    Replace the job's JobOutput rows with `outputs` (terraform output -json format).
+    """
+    JobOutput.query.filter_by(job_id=job.id).delete()
+
+    for name, data in (outputs or {}).items():
+        value = data.get("value")
+        sensitive = bool(data.get("sensitive"))
+
+        db.session.add(JobOutput(
+            job_id=job.id,
+            name=name,
+            value=None if sensitive else _output_text(value),
+            value_json=json.dumps(value),
+            type_json=json.dumps(data.get("type")),
+            sensitive=sensitive,
+        ))
+
+        if sensitive:
+            continue
+
+        if isinstance(value, list):
+            items = [(str(i), item) for i, item in enumerate(value)]
+        elif isinstance(value, dict):
+            items = [(str(k), item) for k, item in value.items()]
+        else:
+            items = []
+
+        for item_key, item in items:
+            text_value = _output_text(item)
+            if text_value is not None:
+                db.session.add(JobOutput(job_id=job.id, name=name, item_key=item_key, value=text_value))
+
+
+def load_job_outputs(job):
+    """
+    Outputs of a job in `terraform output -json` shape, read from JobOutput.
+    """
+    rows = (
+        JobOutput.query.filter_by(job_id=job.id, item_key=None)
+        .order_by(JobOutput.id)
+        .all()
+    )
+    return {
+        row.name: {
+            "value": json.loads(row.value_json) if row.value_json else None,
+            "type": json.loads(row.type_json) if row.type_json else None,
+            "sensitive": bool(row.sensitive),
+        }
+        for row in rows
+    }
+
+
+def backfill_job_outputs():
+    """
+    Index outputs of jobs that finished before the JobOutput table existed.
+    """
+    indexed = db.session.query(JobOutput.job_id).distinct()
+    jobs = Job.query.filter(Job.outputs_json.isnot(None), Job.id.notin_(indexed)).all()
+    for job in jobs:
+        try:
+            store_job_outputs(job, json.loads(job.outputs_json))
+        except (ValueError, AttributeError):
+            continue
+    db.session.commit()
+
+
+# -------------------------
+# Pre-flight Validation Cache
+# -------------------------
+
+VALIDATION_OUTPUT_TAIL = 4000
+
+# Jobs with the same content hash wait for one validation instead of each
+# running their own. Only used on the runner loop; a hash's lock goes away
+# with its last waiter.
+VALIDATION_LOCKS = weakref.WeakValueDictionary()
+
+
+def template_source_dir(template_id):
+    return os.path.join(BASE_DIR, "..", "infra", "templates", "aws", template_id)
+
+
+def validation_verdict(content_hash):
+    """
+    "good" / "bad" from the cache, or None if this content has not been
+    (fully) checked yet.
+    """
+    result = ValidationResult.query.get(content_hash) if content_hash else None
+    if result is None:
+        return None
+
+    fmt_required = app.config["VALIDATE_FMT_CHECK"]
+    if not result.validate_ok or (fmt_required and result.fmt_ok is False):
+        return "bad"
+    if fmt_required and result.fmt_ok is None:
+        return None
+    return "good"
+
+
+def store_validation_result(content_hash, kind, label, validate_ok, fmt_ok, log_file_path):
+    output = None
+    if log_file_path and os.path.isfile(log_file_path):
+        with open(log_file_path, "r", encoding="utf-8", errors="replace") as f:
+            output = f.read()[-VALIDATION_OUTPUT_TAIL:]
+
+    result = ValidationResult.query.get(content_hash) or ValidationResult(content_hash=content_hash)
+    result.kind = kind
+    result.label = label
+    result.validate_ok = validate_ok
+    if fmt_ok is not None or not validate_ok:
+        result.fmt_ok = fmt_ok
+    result.output = output
+    result.checked_at = datetime.utcnow()
+    db.session.add(result)
+    db.session.commit()
+
+
+def rejected_content_message(content_hash, what):
+    """
+    Submit-time check: an error message if this content is known to be broken.
+    """
+    if validation_verdict(content_hash) != "bad":
+        return None
+    result = ValidationResult.query.get(content_hash)
+    check = "terraform validate" if not result.validate_ok else "terraform fmt -check"
+    return (
+        f"{what} failed `{check}` on an earlier run and has not changed since. "
+        f"Fix it and resubmit (details: /validation/{content_hash})."
+    )
+
+
+def record_validation(job_id, control, content_hash, kind, label, validate_ok, fmt_ok, log_file_path):
+    """
+    Store a pre-flight run's timings and (if it reached one) its verdict.
+    Returns the cached verdict afterwards.
+    """
+    record_phase_timings(Job.query.get(job_id), control)
+    db.session.commit()
+    if validate_ok is not None:
+        store_validation_result(content_hash, kind, label, validate_ok, fmt_ok, log_file_path)
+    return validation_verdict(content_hash)
+
+
+def reject_job_content(job_id, control, log_file_path):
+    # Nothing to resume: the content has to change
+    control.failed_phase = None
+    record_job_result(Job.query.get(job_id), control, False, log_file_path, {})
+
+
+async def apreflight_validate(job_id, control, kind, source, label):
+    """
+    Validate a job's template / ZIP before any workspace is prepared, unless
+    the cache already knows its content hash.
+
+    Returns True if the job may go on to init/apply. Otherwise the job has
+    been finished as Failed (or Cancelled / TimedOut).
+    """
+    content_hash, verdict = await db_call(preflight_job, job_id, kind, source)
+    if not content_hash or verdict == "good":
+        return True
+
+    log_file_path = None
+    async with VALIDATION_LOCKS.setdefault(content_hash, asyncio.Lock()):
+        verdict = await db_call(validation_verdict, content_hash)
+        if verdict is None:
+            validate_ok, fmt_ok, log_file_path = await avalidate_terraform_config(
+                job_id=job_id,
+                source=source,
+                logs_dir=LOGS_DIR,
+                check_fmt=app.config["VALIDATE_FMT_CHECK"],
+                control=control,
+            )
+            verdict = await db_call(
+                record_validation, job_id, control, content_hash, kind, label, validate_ok, fmt_ok, log_file_path
+            )
+
+    if verdict == "good":
+        return True
+    if verdict is None and control.outcome is None:
+        # No verdict (e.g. registry unreachable): the run itself will retry
+        return True
+
+    await db_call(reject_job_content, job_id, control, log_file_path)
+    return False
+
+
+def record_resource_usage(job, control):
+    """
+    Store a run's peak RSS / CPU on the job and fold it into its template's profile.
+    """
+    if not control.peak_rss_bytes:
+        return  # nothing sampled (very short run, or no /proc)
+
+    peak_rss_mb = round(control.peak_rss_bytes / (1024 * 1024), 1)
+    job.peak_rss_mb = max(job.peak_rss_mb or 0.0, peak_rss_mb)
+    job.peak_cpu_percent = max(job.peak_cpu_percent or 0.0, control.peak_cpu_percent)
+    job.cpu_seconds = round((job.cpu_seconds or 0.0) + control.cpu_seconds, 2)
+
+    profile = TemplateResourceProfile.query.get(job.template_name or "")
+    if profile is None:
+        profile = TemplateResourceProfile(template_name=job.template_name or "", runs=0)
+        db.session.add(profile)
+
+    weight = app.config["RESOURCE_PROFILE_EWMA_WEIGHT"]
+    runs = profile.runs or 0
+    if runs:
+        profile.ewma_peak_rss_mb = round(weight * peak_rss_mb + (1 - weight) * profile.ewma_peak_rss_mb, 1)
+        profile.avg_cpu_seconds = round((profile.avg_cpu_seconds * runs + control.cpu_seconds) / (runs + 1), 2)
+    else:
+        profile.ewma_peak_rss_mb = peak_rss_mb
+        profile.avg_cpu_seconds = round(control.cpu_seconds, 2)
+    profile.max_peak_rss_mb = max(profile.max_peak_rss_mb or 0.0, peak_rss_mb)
+    profile.max_cpu_percent = max(profile.max_cpu_percent or 0.0, control.peak_cpu_percent)
+    profile.runs = runs + 1
+    profile.updated_at = datetime.utcnow()
+
+
+def record_job_result(job, control, success, log_file_path, outputs):
+    job.log_file_path = log_file_path
+    job.finished_at = datetime.utcnow()
+    job.status = "Success" if success else INTERRUPTED_STATUS.get(control.outcome, "Failed")
+    job.failed_phase = None if success else control.failed_phase
+    record_job_outputs(job, outputs)
+    record_phase_timings(job, control)
+    record_resource_usage(job, control)
+    if control.outcome is not None:
+        release_state_lock(job.id)
+    db.session.commit()
+
+
+def job_run_fields(job_id):
+    """
+    The Job fields a runner coroutine needs, read in one database step.
+    """
+    job = Job.query.get(job_id)
+    return {
+        "job_mode": job.mode,
+        "template_name": job.template_name,
+        "aws_region": job.aws_region,
+        "failed_phase": job.failed_phase,
+        "attempts": job.attempts,
+        "log_file_path": job.log_file_path,
+        "variables": job_variables(job),
+    }
+
+
+def open_queued_job(job_id):
+    """
+    Register a JobControl for a job that is still Queued.
+    Returns (control, job_run_fields) or (None, None).
+    """
+    job = Job.query.get(job_id)
+    if not job or job.status != "Queued":
+        # Missing, or cancelled while it was still waiting in the queue
+        return None, None
+    return start_job_control(job.id, job.template_name), job_run_fields(job.id)
+
+
+def preflight_job(job_id, kind, source):
+    """
+    A job's content hash (worked out on first use for templates) and the
+    cached verdict for it.
+    """
+    job = Job.query.get(job_id)
+    if kind == "template" and not job.content_hash:
+        job.content_hash = template_content_hash(source)
+        db.session.commit()
+    return job.content_hash, validation_verdict(job.content_hash)
+
+
+def claim_queued_job(job_id, control, tf_vars=None):
+    """
+    claim_job() by id; also stores a template job's variables.
+    """
+    job = Job.query.get(job_id)
+    if not claim_job(job, control):
+        return False
+    if tf_vars is not None:
+        job.variables_json = json.dumps(tf_vars)
+        db.session.commit()
+    return True
 
-class User(db.Model):
+
+def next_attempt(job_id):
+    job = Job.query.get(job_id)
+    job.attempts = (job.attempts or 1) + 1
+    db.session.commit()
+    return job_run_fields(job.id)
+
+
+def finish_job(job_id, control, success, log_file_path, outputs):
+    record_job_result(Job.query.get(job_id), control, success, log_file_path, outputs)
+
+
+async def aretry_transient_failures(job_id, control, result, aws_access_key, aws_secret_key, aws_region):
     """
-    Very simple user model for now.
-    Future: proper password hashing + registration system.
+    Resume a job in place while its failures look transient (throttling,
+    network, registry hiccups), with exponential backoff between attempts.
+    Returns the final (success, log_file_path, outputs).
     """
-    id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(128), nullable=False)  # plain for now (NOT for production)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    success, log_file_path, outputs = result
+    retries = 0
+
+    while (
+        not success
+        and control.outcome is None
+        and control.transient
+        and retries < app.config["RETRY_MAX_AUTO_ATTEMPTS"]
+    ):
+        delay = app.config["RETRY_BACKOFF_SECONDS"] * (2 ** retries)
+        if await control.await_cancel(delay):
+            control.outcome = "cancelled"
+            break
+
+        retries += 1
+        fields = await db_call(next_attempt, job_id)
+
+        async with agoverned_slot(control, aws_access_key, aws_region, fields["template_name"]) as admitted:
+            if not admitted:
+                control.outcome = "cancelled"
+                break
+
+            success, log_file_path, outputs = await aresume_terraform_job(
+                job_id=job_id,
+                job_mode=fields["job_mode"],
+                from_phase=control.failed_phase,
+                custom_jobs_root=CUSTOM_JOBS_DIR,
+                base_dir=BASE_DIR,
+                logs_dir=LOGS_DIR,
+                aws_access_key=aws_access_key,
+                aws_secret_key=aws_secret_key,
+                aws_region=aws_region,
+                attempt=fields["attempts"],
+                control=control,
+                state_backend=state_backend_env(job_id),
+                template_name=fields["template_name"],
+                variables=fields["variables"],
+            )
+
+    return success, log_file_path, outputs
+
+
+async def arun_template_job(job_id, template_id, tf_vars, aws_access_key, aws_secret_key, aws_region):
+    control, _ = await db_call(open_queued_job, job_id)
+    if control is None:
+        return
+
+    try:
+        source = template_source_dir(template_id)
+        if not await apreflight_validate(job_id, control, "template", source, template_id):
+            return
 
+        # Stays Queued until the governor admits it for this key + region
+        async with agoverned_slot(control, aws_access_key, aws_region, template_id) as admitted:
+            if not admitted or not await db_call(claim_queued_job, job_id, control, tf_vars):
+                return
+
+            result = await arun_terraform_template_job(
+                job_id=job_id,
+                template_name=template_id,
+                variables=tf_vars,
+                aws_access_key=aws_access_key,
+                aws_secret_key=aws_secret_key,
+                aws_region=aws_region,
+                base_dir=BASE_DIR,
+                logs_dir=LOGS_DIR,
+                control=control,
+                state_backend=state_backend_env(job_id),
+            )
+        success, log_file_path, outputs = await aretry_transient_failures(
+            job_id, control, result, aws_access_key, aws_secret_key, aws_region
+        )
+    finally:
+        finish_job_control(job_id)
 
-class Job(db.Model):
+    await db_call(finish_job, job_id, control, success, log_file_path, outputs)
+
+
+async def arun_custom_job(job_id, zip_path, aws_access_key, aws_secret_key, aws_region):
+    control, _ = await db_call(open_queued_job, job_id)
+    if control is None:
+        return
+
+    try:
+        if not await apreflight_validate(job_id, control, "custom", zip_path, os.path.basename(zip_path)):
+            return
+
+        async with agoverned_slot(control, aws_access_key, aws_region, None) as admitted:
+            if not admitted or not await db_call(claim_queued_job, job_id, control):
+                return
+
+            result = await arun_terraform_custom_job(
+                job_id=job_id,
+                zip_file_path=zip_path,
+                custom_jobs_root=CUSTOM_JOBS_DIR,
+                aws_access_key=aws_access_key,
+                aws_secret_key=aws_secret_key,
+                aws_region=aws_region,
+                logs_dir=LOGS_DIR,
+                control=control,
+                state_backend=state_backend_env(job_id),
+            )
+        success, log_file_path, outputs = await aretry_transient_failures(
+            job_id, control, result, aws_access_key, aws_secret_key, aws_region
+        )
+    finally:
+        finish_job_control(job_id)
+
+    await db_call(finish_job, job_id, control, success, log_file_path, outputs)
+
+
+async def aresume_job(job_id, aws_access_key, aws_secret_key, aws_region):
     """
-    Deployment Job model – template/custom mode, status, logs path etc.
+    Manual retry: re-run a failed job from its failed phase in its existing workspace.
     """
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    control, fields = await db_call(open_queued_job, job_id)
+    if control is None:
+        return
 
-    mode = db.Column(db.String(20), nullable=False)  # "template" / "custom"
-    template_name = db.Column(db.String(100), nullable=True)
+    try:
+        async with agoverned_slot(control, aws_access_key, aws_region, fields["template_name"]) as admitted:
+            if not admitted or not await db_call(claim_queued_job, job_id, control):
+                return
+
+            result = await aresume_terraform_job(
+                job_id=job_id,
+                job_mode=fields["job_mode"],
+                from_phase=fields["failed_phase"],
+                custom_jobs_root=CUSTOM_JOBS_DIR,
+                base_dir=BASE_DIR,
+                logs_dir=LOGS_DIR,
+                aws_access_key=aws_access_key,
+                aws_secret_key=aws_secret_key,
+                aws_region=aws_region,
+                attempt=fields["attempts"],
+                control=control,
+                state_backend=state_backend_env(job_id),
+                template_name=fields["template_name"],
+                variables=fields["variables"],
+            )
+        success, log_file_path, outputs = await aretry_transient_failures(
+            job_id, control, result, aws_access_key, aws_secret_key, aws_region
+        )
+    finally:
+        finish_job_control(job_id)
 
-    status = db.Column(db.String(20), default="Pending")  # Pending / Queued / Running / Success / Failed / Destroyed
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    finished_at = db.Column(db.DateTime, nullable=True)
+    if not success and not control.failed_phase:
+        # Workspace is gone – keep the original log and failure point
+        log_file_path = fields["log_file_path"]
+        control.failed_phase = fields["failed_phase"]
+    await db_call(finish_job, job_id, control, success, log_file_path, outputs)
 
-    log_file_path = db.Column(db.String(255), nullable=True)
 
-    # NEW: store full terraform outputs as JSON string
-    outputs_json = db.Column(db.Text, nullable=True)
+def record_destroy_result(job_id, control, success, log_file_path):
+    job = Job.query.get(job_id)
+    job.finished_at = datetime.utcnow()
+    job.log_file_path = log_file_path
+    job.status = "Destroyed" if success else DESTROY_INTERRUPTED_STATUS.get(control.outcome, "Destroy Failed")
+    # A half-destroyed stack must not be resumed by re-applying it
+    job.failed_phase = None
+    record_phase_timings(job, control)
+    if control.outcome is not None:
+        release_state_lock(job.id)
+    db.session.commit()
 
-    # NEW: a single main output to quickly show on dashboard
-    primary_output = db.Column(db.String(255), nullable=True)
 
+async def adestroy_job_resources(job_id, aws_access_key, aws_secret_key, aws_region):
+    """
+    Run terraform destroy for a job and record the result on the Job row.
+    """
+    await await_drift_check(job_id)
+    fields = await db_call(job_run_fields, job_id)
+    control = start_job_control(job_id, fields["template_name"])
+    try:
+        async with agoverned_slot(control, aws_access_key, aws_region, fields["template_name"]) as admitted:
+            if admitted:
+                success, log_file_path = await arun_terraform_destroy_job(
+                    job_id=job_id,
+                    job_mode=fields["job_mode"],
+                    template_name=fields["template_name"],
+                    custom_jobs_root=CUSTOM_JOBS_DIR,
+                    base_dir=BASE_DIR,
+                    logs_dir=LOGS_DIR,
+                    aws_access_key=aws_access_key,
+                    aws_secret_key=aws_secret_key,
+                    aws_region=aws_region,
+                    control=control,
+                    state_backend=state_backend_env(job_id),
+                    variables=fields["variables"],
+                )
+            else:
+                control.outcome = "cancelled"
+                success, log_file_path = False, fields["log_file_path"]
+    finally:
+        finish_job_control(job_id)
+
+    await db_call(record_destroy_result, job_id, control, success, log_file_path)
+    return success
+
+
+def destroy_job_resources(job, aws_access_key, aws_secret_key, aws_region):
+    """
+    Blocking adestroy_job_resources() for request handlers.
+    Caller must be inside an app context.
+    """
+    success = run_sync(adestroy_job_resources(job.id, aws_access_key, aws_secret_key, aws_region))
+    db.session.refresh(job)
+    return success
 
-def run_template_job_async(job_id, template_id, tf_vars, aws_access_key, aws_secret_key, aws_region):
 
+async def arun_group(group_id, items, aws_access_key, aws_secret_key, max_concurrency):
+    """
+    Run all jobs of a batch group, at most `max_concurrency` at a time.
+    items: list of (job_id, template_id, tf_vars, aws_region)
 
-    with app.app_context():
+    Items whose region currently has governor capacity are started first,
+    so one throttled region does not hold up the rest of the batch.
+    """
+    pending = list(items)
+    running = set()
+
+    while pending or running:
+        while pending and len(running) < max_concurrency:
+            index = next(
+                (
+                    i for i, item in enumerate(pending)
+                    if GOVERNOR.has_capacity(governor_key(aws_access_key, item[3]))
+                ),
+                None,
+            )
+            if index is None:
+                if running:
+                    break
+                index = 0  # nothing has capacity: wait in the governor
+
+            job_id, template_id, tf_vars, aws_region = pending.pop(index)
+            running.add(asyncio.ensure_future(arun_template_job(
+                job_id, template_id, tf_vars, aws_access_key, aws_secret_key, aws_region,
+            )))
+
+        done, running = await asyncio.wait(running, timeout=2, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                app.logger.error("Batch group %s: job failed", group_id, exc_info=task.exception())
+
+
+async def adestroy_group(job_ids, aws_access_key, aws_secret_key, default_region, max_concurrency):
+    def _region(job_id):
         job = Job.query.get(job_id)
         if not job:
-            return
+            return None
+        return job.aws_region or default_region
 
-        job.status = "Running"
-        db.session.commit()
+    slots = asyncio.Semaphore(max_concurrency)
 
-        success, log_file_path, outputs = run_terraform_template_job(
-            job_id=job.id,
-            template_name=template_id,
-            variables=tf_vars,
-            aws_access_key=aws_access_key,
-            aws_secret_key=aws_secret_key,
-            aws_region=aws_region,
-            base_dir=BASE_DIR,
-            logs_dir=LOGS_DIR,
-        )
+    async def _destroy(job_id):
+        async with slots:
+            aws_region = await db_call(_region, job_id)
+            if aws_region is None:
+                return
+            await adestroy_job_resources(job_id, aws_access_key, aws_secret_key, aws_region)
 
-        job.log_file_path = log_file_path
-        job.finished_at = datetime.utcnow()
-        job.status = "Success" if success else "Failed"
+    await asyncio.gather(*(_destroy(job_id) for job_id in job_ids))
+
+
+def summarize_jobs(jobs):
+    """
+    Per-status counts plus one overall status for a set of jobs.
+    """
+    counts = {}
+    for job in jobs:
+        counts[job.status] = counts.get(job.status, 0) + 1
+
+    active = sum(counts.get(s, 0) for s in ("Queued", "Running", "Destroying"))
+    if len(counts) == 1:
+        overall = jobs[0].status
+    elif active:
+        overall = "Running"
+    else:
+        overall = "Partial"
+
+    return overall, counts
 
-        if outputs:
-            job.outputs_json = json.dumps(outputs)
 
-            # Primary output selection per template
-            if template_id == "web_server":
-                ip = outputs.get("instance_public_ip", {}).get("value")
-                dns = outputs.get("instance_public_dns", {}).get("value")
-                job.primary_output = dns or ip
+def group_summary(group):
+    """
+    Aggregated status for a batch group: per-status counts plus one overall status.
+    """
+    jobs = group.jobs.order_by(Job.id).all()
+    overall, counts = summarize_jobs(jobs)
+
+    return {
+        "id": group.id,
+        "template": group.template_name,
+        "max_concurrency": group.max_concurrency,
+        "created_at": group.created_at.isoformat() if group.created_at else None,
+        "status": overall,
+        "total": len(jobs),
+        "counts": counts,
+        "jobs": [
+            {
+                "id": job.id,
+                "region": job.aws_region,
+                "status": job.status,
+                "primary_output": job.primary_output,
+            }
+            for job in jobs
+        ],
+    }
+
 
-            elif template_id == "vpc_basic":
-                vpc_id = outputs.get("vpc_id", {}).get("value")
-                job.primary_output = vpc_id
+def _stack_deps(nodes):
+    return {name: node["depends_on"] for name, node in nodes.items()}
 
-            elif template_id == "s3_cloudfront":
-                cf_domain = outputs.get("cloudfront_domain_name", {}).get("value")
-                site_endpoint = outputs.get("website_endpoint", {}).get("value")
-                job.primary_output = cf_domain or site_endpoint
 
-            elif template_id == "two_tier_app":
-                web_dns = outputs.get("web_public_dns", {}).get("value")
-                web_ip = outputs.get("web_public_ip", {}).get("value")
-                job.primary_output = web_dns or web_ip
+def load_stack(stack_id):
+    """
+    (nodes, max_concurrency, {node: job_id}) of a stack, or None.
+    """
+    stack = Stack.query.get(stack_id)
+    if not stack:
+        return None
+    nodes = json.loads(stack.definition_json)
+    return nodes, stack.max_concurrency, {job.stack_node: job.id for job in stack.jobs}
 
-            elif template_id == "eks_basic":
-                endpoint = outputs.get("cluster_endpoint", {}).get("value")
-                name = outputs.get("cluster_name", {}).get("value")
-                job.primary_output = endpoint or name
 
-            elif template_id == "alb_asg":
-                alb_dns = outputs.get("alb_dns_name", {}).get("value")
-                job.primary_output = alb_dns
+async def arun_stack(stack_id, node_vars, aws_access_key, aws_secret_key):
+    """
+    Apply every node of a stack in dependency order. Independent branches run
+    in parallel; a node starts as soon as all of its upstream jobs succeeded,
+    with their outputs mapped onto its variables.
+    node_vars: {node: tf_vars} validated at submit time
+    """
+    loaded = await db_call(load_stack, stack_id)
+    if loaded is None:
+        return
+    nodes, max_concurrency, job_ids = loaded
+
+    def _node_variables(name):
+        """
+        The node's variables with its upstream outputs filled in, or None
+        (and the job failed) if an upstream output is missing.
+        """
+        node = nodes[name]
+        tf_vars = dict(node_vars[name])
+
+        missing = []
+        for var_name, ref in node["inputs"].items():
+            upstream, output_name = ref.split(".", 1)
+            upstream_job = Job.query.get(job_ids[upstream])
+            outputs = load_job_outputs(upstream_job)
+            if output_name not in outputs:
+                missing.append(ref)
+                continue
+            tf_vars[var_name] = outputs[output_name].get("value")
+
+        if missing:
+            job = Job.query.get(job_ids[name])
+            job.status = "Failed"
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            return None
+        return tf_vars
+
+    def _succeeded(name):
+        return Job.query.get(job_ids[name]).status == "Success"
+
+    async def _run_node(name):
+        tf_vars = await db_call(_node_variables, name)
+        if tf_vars is None:
+            return False
+
+        node = nodes[name]
+        await arun_template_job(
+            job_ids[name], node["template_id"], tf_vars,
+            aws_access_key, aws_secret_key, node["aws_region"],
+        )
+        return await db_call(_succeeded, name)
 
-            elif template_id == "secure_web_hosting":
-                ip = outputs.get("instance_public_ip", {}).get("value")
-                dns = outputs.get("instance_public_dns", {}).get("value")
-                job.primary_output = dns or ip
+    results = await arun_dag(_stack_deps(nodes), _run_node, max_workers=max_concurrency)
 
+    def _mark_skipped():
+        for name, result in results.items():
+            if result == "skipped":
+                job = Job.query.get(job_ids[name])
+                job.status = "Skipped"
         db.session.commit()
 
+    await db_call(_mark_skipped)
 
-def run_custom_job_async(job_id, zip_path, aws_access_key, aws_secret_key, aws_region):
-    with app.app_context():
-        job = Job.query.get(job_id)
-        if not job:
-            return
 
-        job.status = "Running"
+async def adestroy_stack(stack_id, previous_status, aws_access_key, aws_secret_key):
+    """
+    Destroy a stack in reverse topological order: a node is destroyed only
+    after everything that depends on it has been destroyed.
+    previous_status: {job_id: status before it was marked "Destroying"}
+    """
+    loaded = await db_call(load_stack, stack_id)
+    if loaded is None:
+        return
+    nodes, max_concurrency, job_ids = loaded
+
+    def _settle_without_terraform(name):
+        """
+        True / False if the node needs no destroy run, None if it does.
+        """
+        job = Job.query.get(job_ids[name])
+        if job.status != "Destroying":
+            # Already destroyed or never queued for destroy
+            return job.status in ("Skipped", "Destroyed")
+        if not job.workspace_created:
+            # Never reached terraform (missing upstream output, failed
+            # pre-flight validation) – nothing to tear down
+            job.status = previous_status[job.id]
+            db.session.commit()
+            return True
+        return None
+
+    async def _destroy_node(name):
+        settled = await db_call(_settle_without_terraform, name)
+        if settled is not None:
+            return settled
+        return await adestroy_job_resources(job_ids[name], aws_access_key, aws_secret_key, nodes[name]["aws_region"])
+
+    await arun_dag(_stack_deps(nodes), _destroy_node, max_workers=max_concurrency, reverse=True)
+
+    def _restore_blocked():
+        # Nodes blocked by a failed downstream destroy keep their previous status
+        for job in Stack.query.get(stack_id).jobs.filter_by(status="Destroying"):
+            job.status = previous_status[job.id]
         db.session.commit()
 
-        success, log_file_path, outputs = run_terraform_custom_job(
-            job_id=job.id,
-            zip_file_path=zip_path,
-            custom_jobs_root=CUSTOM_JOBS_DIR,
-            aws_access_key=aws_access_key,
-            aws_secret_key=aws_secret_key,
-            aws_region=aws_region,
-            logs_dir=LOGS_DIR,
-        )
+    await db_call(_restore_blocked)
+
+
+def stack_summary(stack):
+    jobs = stack.jobs.order_by(Job.id).all()
+    overall, counts = summarize_jobs(jobs)
+    nodes = json.loads(stack.definition_json)
+
+    return {
+        "id": stack.id,
+        "name": stack.name,
+        "max_concurrency": stack.max_concurrency,
+        "created_at": stack.created_at.isoformat() if stack.created_at else None,
+        "status": overall,
+        "counts": counts,
+        "order": topological_order(_stack_deps(nodes)),
+        "nodes": {
+            job.stack_node: {
+                "job_id": job.id,
+                "template": job.template_name,
+                "region": job.aws_region,
+                "depends_on": nodes[job.stack_node]["depends_on"],
+                "status": job.status,
+                "primary_output": job.primary_output,
+            }
+            for job in jobs
+        },
+    }
 
-        job.log_file_path = log_file_path if isinstance(log_file_path, str) else None
-        job.finished_at = datetime.utcnow()
-        job.status = "Success" if success else "Failed"
+# -------------------------
+# Drift Detection
+# -------------------------
 
-        if outputs:
-            job.outputs_json = json.dumps(outputs)
+DRIFT_STATUS = {"in_sync": "InSync", "drifted": "Drifted", "error": "Error"}
 
-            # For generic custom projects, we don't know which is main,
-            # but we can pick the first key's value as primary_output
-            try:
-                first_key = next(iter(outputs))
-                val = outputs[first_key].get("value")
-                job.primary_output = str(val)
-            except Exception:
-                pass
+# Drift checks of every scan (manual or periodic) run as tasks on the runner's
+# event loop, DRIFT_MAX_WORKERS at a time
+DRIFT_SLOTS = asyncio.Semaphore(app.config["DRIFT_MAX_WORKERS"])
+
+# job_id -> asyncio.Event set once its queued / running drift check is done
+# (guarded by ACTIVE_JOBS_LOCK, like the JobControl the check registers)
+DRIFT_CHECKS = {}
+
+
+def drift_candidates(fingerprint, user_id=None, force=False):
+    """
+    Live jobs due for a drift check: successfully applied with the access key
+    of `fingerprint`, not being worked on right now, and not checked within
+    DRIFT_RECHECK_SECONDS (unless force). Jobs deployed before fingerprints
+    were recorded are never checked, since their account is unknown.
+
+    Each returned job is registered in ACTIVE_JOBS right away, so overlapping
+    scans never check a job twice and a check can be cancelled like any run.
+    Returns {job_id: JobControl}.
+    """
+    query = Job.query.filter(Job.status == "Success", Job.credential_fingerprint == fingerprint)
+    if user_id is not None:
+        query = query.filter(Job.user_id == user_id)
+    if not force:
+        cutoff = datetime.utcfromtimestamp(time.time() - app.config["DRIFT_RECHECK_SECONDS"])
+        query = query.filter(db.or_(Job.drift_checked_at.is_(None), Job.drift_checked_at < cutoff))
+
+    controls = {}
+    with ACTIVE_JOBS_LOCK:
+        for job in query.order_by(Job.drift_checked_at.asc(), Job.id).all():
+            if job.id not in ACTIVE_JOBS:
+                controls[job.id] = ACTIVE_JOBS[job.id] = JobControl(timeouts=phase_timeouts(job.template_name))
+                DRIFT_CHECKS[job.id] = asyncio.Event()
+    return controls
+
+
+def live_job_fields(job_id):
+    job = Job.query.get(job_id)
+    if not job or job.status != "Success":
+        return None
+    return job_run_fields(job.id)
+
+
+def record_drift_result(job_id, status, log_file_path, changed):
+    job = Job.query.get(job_id)
+    now = datetime.utcnow()
+    job.drift_status = DRIFT_STATUS[status]
+    job.drift_checked_at = now
+    db.session.add(DriftCheck(
+        job_id=job.id,
+        status=job.drift_status,
+        changed_json=json.dumps(changed),
+        log_file_path=log_file_path,
+        checked_at=now,
+    ))
+    db.session.commit()
+
+
+def finish_drift_check(job_id):
+    with ACTIVE_JOBS_LOCK:
+        ACTIVE_JOBS.pop(job_id, None)
+        done = DRIFT_CHECKS.pop(job_id)
+    done.set()
+
+
+async def await_drift_check(job_id):
+    """
+    Cancel a drift check queued or running in a job's workspace and wait for
+    it to let go, so a destroy never starts mid-check.
+    """
+    with ACTIVE_JOBS_LOCK:
+        done = DRIFT_CHECKS.get(job_id)
+        control = ACTIVE_JOBS.get(job_id)
+    if done is None:
+        return
+    control.cancel()
+    await done.wait()
+
+
+async def acheck_job_drift(job_id, control, aws_access_key, aws_secret_key, default_region):
+    try:
+        async with DRIFT_SLOTS:
+            fields = await db_call(live_job_fields, job_id)
+            if fields is None or control.cancel_requested:
+                return
+
+            aws_region = fields["aws_region"] or default_region
+            async with agoverned_slot(control, aws_access_key, aws_region, fields["template_name"]) as admitted:
+                if not admitted:
+                    return
+
+                status, log_file_path, changed = await arun_terraform_drift_check(
+                    job_id=job_id,
+                    job_mode=fields["job_mode"],
+                    template_name=fields["template_name"],
+                    custom_jobs_root=CUSTOM_JOBS_DIR,
+                    base_dir=BASE_DIR,
+                    logs_dir=LOGS_DIR,
+                    aws_access_key=aws_access_key,
+                    aws_secret_key=aws_secret_key,
+                    aws_region=aws_region,
+                    control=control,
+                    state_backend=state_backend_env(job_id),
+                    variables=fields["variables"],
+                )
+
+            if control.outcome == "cancelled":
+                return  # no verdict, e.g. cancelled for a destroy
+
+            # Stored per job as soon as it finishes, so a long scan is visible incrementally
+            await db_call(record_drift_result, job_id, status, log_file_path, changed)
+    finally:
+        finish_drift_check(job_id)
+
+
+async def arun_drift_scan(controls, aws_access_key, aws_secret_key, default_region):
+    """
+    Check the jobs claimed by drift_candidates() as tasks on the runner's
+    event loop. All scans share DRIFT_MAX_WORKERS slots, and each check also
+    takes a governor slot for its access key + region, so a sweep shares the
+    AWS rate limit fairly with deploys instead of tripping it.
+    """
+    await asyncio.gather(*(
+        acheck_job_drift(job_id, control, aws_access_key, aws_secret_key, default_region)
+        for job_id, control in controls.items()
+    ))
+
+
+def drift_scheduler_loop():
+    """
+    Periodic sweep over every user's live jobs that were deployed with the
+    AWS credentials of the engine's own environment.
+    """
+    interval = app.config["DRIFT_SCAN_INTERVAL_SECONDS"]
+    aws_access_key = os.environ.get("AWS_ACCESS_KEY_ID", "")
+    aws_secret_key = os.environ.get("AWS_SECRET_ACCESS_KEY", "")
+    default_region = os.environ.get("AWS_DEFAULT_REGION", "ap-south-1")
+
+    fingerprint = credential_fingerprint(aws_access_key)
+
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            controls = drift_candidates(fingerprint)
+        if controls:
+            run_sync(arun_drift_scan(controls, aws_access_key, aws_secret_key, default_region))
+
+
+def start_drift_scheduler():
+    if app.config["DRIFT_SCAN_INTERVAL_SECONDS"] <= 0:
+        return
+    if not os.environ.get("AWS_ACCESS_KEY_ID") or not os.environ.get("AWS_SECRET_ACCESS_KEY"):
+        app.logger.warning("Drift scheduler disabled: no AWS credentials in the environment.")
+        return
+    threading.Thread(target=drift_scheduler_loop, daemon=True, name="drift-scheduler").start()
+
+
+BACKGROUND_THREADS_LOCK = threading.Lock()
+BACKGROUND_THREADS_STARTED = False
+
+
+def start_background_threads():
+    """
+    Start the drift scheduler and the job count reconciler, once per process.
+    """
+    global BACKGROUND_THREADS_STARTED
+    with BACKGROUND_THREADS_LOCK:
+        if BACKGROUND_THREADS_STARTED:
+            return
+        BACKGROUND_THREADS_STARTED = True
+
+    start_drift_scheduler()
+    start_job_counts_reconciler()
+
+# -------------------------
+# Job History Export
+# -------------------------
+
+EXPORT_FORMATS = ("ndjson", "csv")
+
+EXPORT_CSV_COLUMNS = [
+    "id", "user_id", "mode", "template_name", "aws_region", "status",
+    "created_at", "finished_at", "duration_seconds", "attempts", "failed_phase",
+    "group_id", "stack_id", "stack_node", "drift_status", "primary_output",
+    "peak_rss_mb", "peak_cpu_percent", "cpu_seconds",
+    "outputs", "phases", "status_history", "resume_token",
+]
+
+
+def export_token(job_id):
+    return base64.urlsafe_b64encode(f"job:{job_id}".encode()).decode().rstrip("=")
+
+
+def parse_export_token(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        prefix, job_id = base64.urlsafe_b64decode(padded).decode().split(":", 1)
+        return int(job_id) if prefix == "job" else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _parse_export_date(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def parse_export_filters(args):
+    """
+    Validate export filters from query args (or CLI options).
+
+    Returns:
+        (filters: dict | None, error: str | None)
+    """
+    filters = {"after_id": 0}
+
+    statuses = [part.strip() for part in (args.get("status") or "").split(",") if part.strip()]
+    if statuses:
+        filters["statuses"] = statuses
+
+    for name in ("template", "mode", "region"):
+        value = (args.get(name) or "").strip()
+        if value:
+            filters[name] = value
+
+    for name in ("since", "until"):
+        value = (args.get(name) or "").strip()
+        if value:
+            parsed = _parse_export_date(value)
+            if parsed is None:
+                return None, f"{name} must be an ISO date or datetime."
+            filters[name] = parsed
+
+    token = (args.get("resume") or "").strip()
+    if token:
+        after_id = parse_export_token(token)
+        if after_id is None:
+            return None, "Invalid resume token."
+        filters["after_id"] = after_id
+
+    return filters, None
+
+
+def _export_query(filters, user_id, after_id):
+    query = Job.query.filter(Job.id > after_id)
+    if user_id is not None:
+        query = query.filter(Job.user_id == user_id)
+    if "statuses" in filters:
+        query = query.filter(Job.status.in_(filters["statuses"]))
+    if "template" in filters:
+        query = query.filter(Job.template_name == filters["template"])
+    if "mode" in filters:
+        query = query.filter(Job.mode == filters["mode"])
+    if "region" in filters:
+        query = query.filter(Job.aws_region == filters["region"])
+    if "since" in filters:
+        query = query.filter(Job.created_at >= filters["since"])
+    if "until" in filters:
+        query = query.filter(Job.created_at < filters["until"])
+    return query.order_by(Job.id)
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def job_export_row(job, outputs, events):
+    duration = None
+    if job.created_at and job.finished_at:
+        duration = round((job.finished_at - job.created_at).total_seconds(), 3)
+
+    return {
+        "id": job.id,
+        "user_id": job.user_id,
+        "mode": job.mode,
+        "template_name": job.template_name,
+        "aws_region": job.aws_region,
+        "status": job.status,
+        "created_at": _iso(job.created_at),
+        "finished_at": _iso(job.finished_at),
+        "duration_seconds": duration,
+        "attempts": job.attempts,
+        "failed_phase": job.failed_phase,
+        "group_id": job.group_id,
+        "stack_id": job.stack_id,
+        "stack_node": job.stack_node,
+        "drift_status": job.drift_status,
+        "primary_output": job.primary_output,
+        "peak_rss_mb": job.peak_rss_mb,
+        "peak_cpu_percent": job.peak_cpu_percent,
+        "cpu_seconds": job.cpu_seconds,
+        "outputs": outputs,
+        "phases": [
+            {
+                "phase": e.name,
+                "started_at": _iso(e.at),
+                "duration_seconds": e.duration_seconds,
+                "exit_code": e.exit_code,
+            }
+            for e in events if e.kind == "phase"
+        ],
+        "status_history": [
+            {"status": e.name, "at": _iso(e.at)}
+            for e in events if e.kind == "status"
+        ],
+        "resume_token": export_token(job.id),
+    }
+
+
+def iter_job_export(filters, user_id=None):
+    """
+    Yield export rows for matching jobs in id order.
+
+    Jobs are read in keyset-paginated batches (id > last id) rather than
+    through one long-lived cursor: every batch is a short read transaction,
+    so an export of any size keeps memory flat and never holds SQLite's lock
+    long enough to block job updates. Sensitive output values are redacted.
+    """
+    after_id = filters.get("after_id", 0)
+    batch_size = app.config["EXPORT_BATCH_SIZE"]
+
+    while True:
+        jobs = _export_query(filters, user_id, after_id).limit(batch_size).all()
+        if not jobs:
+            return
+
+        ids = [job.id for job in jobs]
+        outputs = {job_id: {} for job_id in ids}
+        for row in JobOutput.query.filter(JobOutput.job_id.in_(ids), JobOutput.item_key.is_(None)).order_by(JobOutput.id):
+            outputs[row.job_id][row.name] = {
+                "value": None if row.sensitive or not row.value_json else json.loads(row.value_json),
+                "sensitive": bool(row.sensitive),
+            }
+
+        events = {job_id: [] for job_id in ids}
+        for row in JobEvent.query.filter(JobEvent.job_id.in_(ids)).order_by(JobEvent.id):
+            events[row.job_id].append(row)
+
+        rows = [job_export_row(job, outputs[job.id], events[job.id]) for job in jobs]
+        after_id = ids[-1]
+
+        # End the read transaction and drop the batch from the identity map
+        db.session.close()
+
+        yield from rows
+
+
+def format_export(rows, fmt):
+    """
+    Serialize export rows as NDJSON lines or CSV (nested fields as JSON).
+    """
+    if fmt == "ndjson":
+        for row in rows:
+            yield json.dumps(row, default=str) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    yield flush()
+    for row in rows:
+        writer.writerow([
+            json.dumps(row[column], default=str) if isinstance(row[column], (dict, list)) else row[column]
+            for column in EXPORT_CSV_COLUMNS
+        ])
+        yield flush()
+
+
+@app.cli.command("export-jobs")
+@click.option("--format", "fmt", type=click.Choice(EXPORT_FORMATS), default="ndjson")
+@click.option("--output", "output_path", type=click.Path(dir_okay=False), help="File to write (default: stdout).")
+@click.option("--user", "user_email", help="Only jobs of this user (default: all users).")
+@click.option("--status", help="Comma-separated statuses.")
+@click.option("--template")
+@click.option("--mode", type=click.Choice(["template", "custom"]))
+@click.option("--region")
+@click.option("--since", help="Created at or after (ISO date).")
+@click.option("--until", help="Created before (ISO date).")
+@click.option("--resume", help="resume_token of the last row already exported.")
+def export_jobs_command(fmt, output_path, user_email, **options):
+    """
+    Stream job history (outputs, phase timings, status history) as NDJSON / CSV.
+    """
+    filters, error = parse_export_filters(options)
+    if error:
+        raise click.BadParameter(error)
+
+    user_id = None
+    if user_email:
+        user = User.query.filter_by(email=user_email).first()
+        if not user:
+            raise click.BadParameter(f"No user with email {user_email}.")
+        user_id = user.id
+
+    chunks = format_export(iter_job_export(filters, user_id=user_id), fmt)
+    if output_path:
+        with open(output_path, "w", encoding="utf-8", newline="") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    else:
+        for chunk in chunks:
+            click.echo(chunk, nl=False)
 
-        db.session.commit()
 
 # -------------------------
 # Helper: Login Required Decorator
@@ -208,14 +2210,64 @@ def login_required(f):
 # Initial DB + Default User
 # -------------------------
 
+# db.create_all() never alters existing tables, so columns added to Job after
+# the first release are patched onto older cloudinfra.db files here.
+# (column name, SQL type, indexed)
+JOB_COLUMN_UPGRADES = [
+    ("aws_region", "VARCHAR(30)", False),
+    ("group_id", "INTEGER", True),
+    ("stack_id", "INTEGER", True),
+    ("stack_node", "VARCHAR(100)", False),
+    ("failed_phase", "VARCHAR(20)", False),
+    ("attempts", "INTEGER DEFAULT 1", False),
+    ("variables_json", "TEXT", False),
+    ("drift_status", "VARCHAR(20)", False),
+    ("drift_checked_at", "DATETIME", True),
+    ("content_hash", "VARCHAR(64)", True),
+    ("peak_rss_mb", "FLOAT", False),
+    ("peak_cpu_percent", "FLOAT", False),
+    ("cpu_seconds", "FLOAT", False),
+    ("workspace_created", "BOOLEAN DEFAULT 0", False),
+    ("credential_fingerprint", "VARCHAR(12)", True),
+]
+
+# Run once when a column is first added, to derive it for existing rows
+JOB_COLUMN_BACKFILLS = {
+    # Before the flag existed, a log file meant Terraform had run
+    "workspace_created": "UPDATE job SET workspace_created = 1 WHERE log_file_path IS NOT NULL",
+}
+
+
+def upgrade_job_table():
+    existing = {row[1] for row in db.session.execute(text("PRAGMA table_info(job)"))}
+    for name, sql_type, indexed in JOB_COLUMN_UPGRADES:
+        if name not in existing:
+            db.session.execute(text(f"ALTER TABLE job ADD COLUMN {name} {sql_type}"))
+            if name in JOB_COLUMN_BACKFILLS:
+                db.session.execute(text(JOB_COLUMN_BACKFILLS[name]))
+        if indexed:
+            db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_job_{name} ON job ({name})"))
+    db.session.commit()
+
+
 with app.app_context():
     db.create_all()
+    upgrade_job_table()
+    backfill_job_outputs()
+    reconcile_job_counts()
+    release_stale_state_locks()
 
     existing = User.query.filter_by(email="admin@example.com").first()
     if not existing:
         user = User(email="admin@example.com", password="admin123")
         db.session.add(user)
         db.session.commit()
+
+# Under the debug reloader the parent process only watches files; the
+# threads belong in the child that actually serves requests.
+if not (app.debug or __name__ == "__main__") or is_running_from_reloader():
+    start_background_threads()
+
 # -------------------------
 # Routes
 # -------------------------
@@ -278,45 +2330,230 @@ def view_job_logs(job_id):
         flash("Job not found or you don't have access.", "danger")
         return redirect(url_for("dashboard"))
 
-    log_content = ""
-    if job.log_file_path and os.path.isfile(job.log_file_path):
-        with open(job.log_file_path, "r", encoding="utf-8") as f:
-            log_content = f.read()
+    log_content = ""
+    if job.log_file_path and os.path.isfile(job.log_file_path):
+        with open(job.log_file_path, "r", encoding="utf-8") as f:
+            log_content = f.read()
+    else:
+        log_content = "No log file found for this job."
+
+    return render_template("logs.html", job=job, log_content=log_content)
+
+@app.route("/jobs/<int:job_id>/logs/stream")
+@login_required
+def stream_job_logs(job_id):
+    """
+    Returns the latest content of a job's log file.
+    Used by frontend JS for live log updates.
+    """
+    user_id = session.get("user_id")
+    job = Job.query.filter_by(id=job_id, user_id=user_id).first()
+
+    if not job:
+        return "Job not found or unauthorized.", 404
+
+    if not job.log_file_path or not os.path.isfile(job.log_file_path):
+        # Log file might not be created yet
+        return "", 200
+
+    try:
+        with open(job.log_file_path, "r", encoding="utf-8") as f:
+            content = f.read()
+    except Exception:
+        content = "Error reading log file."
+
+    # plain text response (easy for frontend)
+    return content, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+
+@app.route("/capacity")
+@login_required
+def capacity():
+    """
+    Capacity planning (admins): host memory admission state, per-template
+    resource profiles and live usage of running jobs.
+    """
+    if session.get("user_email") not in app.config["ADMIN_EMAILS"]:
+        return jsonify({"errors": ["Capacity data is limited to admins."]}), 403
+
+    with ACTIVE_JOBS_LOCK:
+        running = list(ACTIVE_JOBS.items())
+
+    mb = 1024 * 1024
+    return jsonify({
+        "host": MEMORY_ADMISSION.snapshot(),
+        "templates": [
+            {
+                "template": profile.template_name or "custom",
+                "runs": profile.runs,
+                "ewma_peak_rss_mb": profile.ewma_peak_rss_mb,
+                "max_peak_rss_mb": profile.max_peak_rss_mb,
+                "max_cpu_percent": profile.max_cpu_percent,
+                "avg_cpu_seconds": profile.avg_cpu_seconds,
+                "expected_peak_mb": round(expected_job_bytes(profile.template_name) / mb, 1),
+                "updated_at": profile.updated_at.isoformat() if profile.updated_at else None,
+            }
+            for profile in TemplateResourceProfile.query.order_by(TemplateResourceProfile.template_name)
+        ],
+        "running": [
+            {
+                "job_id": job_id,
+                "phase": control.phase,
+                "rss_mb": round(control.rss_bytes / mb, 1),
+                "peak_rss_mb": round(control.peak_rss_bytes / mb, 1),
+                "peak_cpu_percent": control.peak_cpu_percent,
+            }
+            for job_id, control in running
+        ],
+    })
+
+
+@app.route("/validation/<content_hash>")
+@login_required
+def view_validation(content_hash):
+    """
+    Cached pre-flight result for a template / upload content hash.
+    """
+    result = ValidationResult.query.get(content_hash)
+    if not result:
+        return jsonify({"errors": ["No validation result for this hash."]}), 404
+
+    return jsonify({
+        "content_hash": result.content_hash,
+        "kind": result.kind,
+        "label": result.label,
+        "verdict": validation_verdict(result.content_hash),
+        "validate_ok": result.validate_ok,
+        "fmt_ok": result.fmt_ok,
+        "checked_at": result.checked_at.isoformat() if result.checked_at else None,
+        "output": result.output,
+    })
+
+
+@app.route("/jobs/summary")
+@login_required
+def jobs_summary():
+    """
+    Job counts by status and template from the incremental counters – cheap
+    enough for screens that refresh every few seconds.
+    Admins get fleet-wide numbers; ?scope=user limits them to their own jobs.
+    """
+    is_admin = session.get("user_email") in app.config["ADMIN_EMAILS"]
+    scope = request.args.get("scope") or ("fleet" if is_admin else "user")
+
+    if scope not in ("user", "fleet"):
+        return jsonify({"errors": ["scope must be 'user' or 'fleet'."]}), 400
+    if scope == "fleet" and not is_admin:
+        return jsonify({"errors": ["Fleet-wide summary is limited to admins."]}), 403
+
+    summary = job_counts_summary(None if scope == "fleet" else session.get("user_id"))
+    summary["scope"] = scope
+    return jsonify(summary)
+
+
+@app.route("/jobs/export")
+@login_required
+def export_jobs():
+    """
+    Stream your job history as NDJSON (default) or CSV (?format=csv).
+
+    Filters: status (comma-separated), template, mode, region, since, until.
+    Every row carries a resume_token; pass the last one as ?resume=... to
+    continue an interrupted export.
+    """
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"errors": [f"format must be one of {', '.join(EXPORT_FORMATS)}."]}), 400
+
+    filters, error = parse_export_filters(request.args)
+    if error:
+        return jsonify({"errors": [error]}), 400
+
+    rows = iter_job_export(filters, user_id=session.get("user_id"))
+    mimetype = "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+    return Response(
+        stream_with_context(format_export(rows, fmt)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=jobs.{fmt}"},
+    )
+
+
+@app.route("/jobs/<int:job_id>/destroy", methods=["POST"])
+@login_required
+def destroy_job(job_id):
+    user_id = session.get("user_id")
+    job = Job.query.filter_by(id=job_id, user_id=user_id).first()
+
+    if not job:
+        flash("Job not found or unauthorized access.", "danger")
+        return redirect(url_for("dashboard"))
+
+    # Read AWS credentials from form
+    aws_access_key = request.form.get("aws_access_key", "").strip()
+    aws_secret_key = request.form.get("aws_secret_key", "").strip()
+    aws_region = request.form.get("aws_region", "ap-south-1").strip()
+
+    if not aws_access_key or not aws_secret_key:
+        flash("AWS credentials are required for destroy action.", "danger")
+        return redirect(url_for("dashboard"))
+
+    if not job.workspace_created:
+        # Cancelled while queued or failed pre-flight: Terraform never ran
+        flash(f"Job #{job.id} never reached Terraform; nothing to destroy.", "info")
+        return redirect(url_for("dashboard"))
+
+    # Run destroy
+    success = destroy_job_resources(job, aws_access_key, aws_secret_key, aws_region)
+
+    if success:
+        flash(f"Destroy successful for Job #{job.id}", "success")
     else:
-        log_content = "No log file found for this job."
+        flash(f"Destroy FAILED for Job #{job.id}. Check logs.", "danger")
 
-    return render_template("logs.html", job=job, log_content=log_content)
+    return redirect(url_for("dashboard"))
 
-@app.route("/jobs/<int:job_id>/logs/stream")
+@app.route("/jobs/<int:job_id>/cancel", methods=["POST"])
 @login_required
-def stream_job_logs(job_id):
+def cancel_job(job_id):
     """
-    Returns the latest content of a job's log file.
-    Used by frontend JS for live log updates.
+    Cancel a queued or running job. Queued jobs are dropped before they start;
+    running Terraform gets SIGINT first so it can persist state.
     """
     user_id = session.get("user_id")
     job = Job.query.filter_by(id=job_id, user_id=user_id).first()
 
     if not job:
-        return "Job not found or unauthorized.", 404
+        flash("Job not found or unauthorized access.", "danger")
+        return redirect(url_for("dashboard"))
 
-    if not job.log_file_path or not os.path.isfile(job.log_file_path):
-        # Log file might not be created yet
-        return "", 200
+    with ACTIVE_JOBS_LOCK:
+        control = ACTIVE_JOBS.get(job.id)
 
-    try:
-        with open(job.log_file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-    except Exception:
-        content = "Error reading log file."
+    if job.status == "Queued":
+        job.status = "Cancelled"
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        if control is not None:
+            # Waiting for a governor slot
+            control.cancel()
+        flash(f"Job #{job.id} cancelled before it started.", "info")
+        return redirect(url_for("dashboard"))
 
-    # plain text response (easy for frontend)
-    return content, 200, {"Content-Type": "text/plain; charset=utf-8"}
+    if control is None:
+        flash(f"Job #{job.id} is not running.", "warning")
+        return redirect(url_for("dashboard"))
 
+    control.cancel()
+    flash(f"Cancellation requested for Job #{job.id}. Terraform is being interrupted.", "info")
+    return redirect(url_for("dashboard"))
 
-@app.route("/jobs/<int:job_id>/destroy", methods=["POST"])
+@app.route("/jobs/<int:job_id>/retry", methods=["POST"])
 @login_required
-def destroy_job(job_id):
+def retry_job(job_id):
+    """
+    Resume a failed job from the phase that failed, reusing its workspace,
+    .terraform/ directory and partial state instead of starting over.
+    """
     user_id = session.get("user_id")
     job = Job.query.filter_by(id=job_id, user_id=user_id).first()
 
@@ -324,39 +2561,25 @@ def destroy_job(job_id):
         flash("Job not found or unauthorized access.", "danger")
         return redirect(url_for("dashboard"))
 
-    # Read AWS credentials from form
+    if job.status not in ("Failed", "TimedOut", "Cancelled") or not job.failed_phase:
+        flash(f"Job #{job.id} has no failed phase to resume.", "warning")
+        return redirect(url_for("dashboard"))
+
     aws_access_key = request.form.get("aws_access_key", "").strip()
     aws_secret_key = request.form.get("aws_secret_key", "").strip()
-    aws_region = request.form.get("aws_region", "ap-south-1").strip()
+    aws_region = request.form.get("aws_region", "").strip() or job.aws_region or "ap-south-1"
 
     if not aws_access_key or not aws_secret_key:
-        flash("AWS credentials are required for destroy action.", "danger")
+        flash("AWS credentials are required to retry a job.", "danger")
         return redirect(url_for("dashboard"))
 
-    # Run destroy
-    success, log_file_path = run_terraform_destroy_job(
-        job_id=job.id,
-        job_mode=job.mode,
-        template_name=job.template_name,
-        custom_jobs_root=CUSTOM_JOBS_DIR,
-        base_dir=BASE_DIR,
-        logs_dir=LOGS_DIR,
-        aws_access_key=aws_access_key,
-        aws_secret_key=aws_secret_key,
-        aws_region=aws_region,
-    )
-
-    # Update job fields
-    job.finished_at = datetime.utcnow()
-    job.log_file_path = log_file_path
-    job.status = "Destroyed" if success else "Destroy Failed"
+    job.status = "Queued"
+    job.attempts = (job.attempts or 1) + 1
     db.session.commit()
 
-    if success:
-        flash(f"Destroy successful for Job #{job.id}", "success")
-    else:
-        flash(f"Destroy FAILED for Job #{job.id}. Check logs.", "danger")
+    start_job_task(aresume_job(job.id, aws_access_key, aws_secret_key, aws_region), f"Job #{job.id}")
 
+    flash(f"Job #{job.id} is resuming from '{job.failed_phase}'.", "info")
     return redirect(url_for("dashboard"))
 
 @app.route("/jobs/<int:job_id>/outputs")
@@ -369,15 +2592,329 @@ def view_job_outputs(job_id):
         flash("Job not found or unauthorized.", "danger")
         return redirect(url_for("dashboard"))
 
-    outputs = {}
-    if job.outputs_json:
-        try:
-            outputs = json.loads(job.outputs_json)
-        except Exception:
-            outputs = {}
+    outputs = load_job_outputs(job)
 
     return render_template("outputs.html", job=job, outputs=outputs)
 
+
+def _output_matches(rows):
+    return [
+        {
+            "job_id": job.id,
+            "template": job.template_name,
+            "mode": job.mode,
+            "status": job.status,
+            "region": job.aws_region,
+            "output": row.name,
+            "item": row.item_key,
+            "value": row.value,
+        }
+        for row, job in rows
+    ]
+
+
+@app.route("/outputs/lookup")
+@login_required
+def lookup_outputs():
+    """
+    Search outputs across your jobs by output name and/or exact value.
+    e.g. /outputs/lookup?name=alb_dns_name  or  /outputs/lookup?value=vpc-0abc123
+    """
+    user_id = session.get("user_id")
+    name = request.args.get("name", "").strip()
+    value = request.args.get("value", "").strip()
+
+    if not name and not value:
+        return jsonify({"errors": ["Provide name and/or value."]}), 400
+
+    query = (
+        db.session.query(JobOutput, Job)
+        .join(Job, Job.id == JobOutput.job_id)
+        .filter(Job.user_id == user_id)
+    )
+    if name:
+        query = query.filter(JobOutput.name == name)
+    if value:
+        query = query.filter(JobOutput.value == value)
+    elif name:
+        # Name-only search lists each output once, not every list element
+        query = query.filter(JobOutput.item_key.is_(None))
+
+    rows = query.order_by(Job.id.desc(), JobOutput.id).limit(500).all()
+    return jsonify({"matches": _output_matches(rows)})
+
+
+@app.route("/outputs/owner/<path:identifier>")
+@login_required
+def output_owner(identifier):
+    """
+    Reverse lookup: which job produced this resource identifier
+    (VPC ID, subnet ID, ALB DNS name, bucket, ...)?
+    """
+    user_id = session.get("user_id")
+    rows = (
+        db.session.query(JobOutput, Job)
+        .join(Job, Job.id == JobOutput.job_id)
+        .filter(Job.user_id == user_id, JobOutput.value == identifier)
+        .order_by(Job.id.desc(), JobOutput.id)
+        .all()
+    )
+
+    if not rows:
+        return jsonify({"errors": [f"No job output matches '{identifier}'."]}), 404
+
+    return jsonify({"identifier": identifier, "owners": _output_matches(rows)})
+
+# -------------------------
+# Terraform HTTP State Backend
+# -------------------------
+
+def _state_response(body, status):
+    return body, status, {"Content-Type": "application/json"}
+
+
+def _current_state_lock(name):
+    return TerraformStateLock.query.get(name)
+
+
+@app.route("/tfstate/<name>", methods=["GET", "POST", "DELETE", "LOCK", "UNLOCK"])
+def terraform_state(name):
+    """
+    Terraform `http` backend endpoint. Authenticated with HTTP basic auth:
+    username = state name, password = state_token(name) – see state_backend_env().
+    """
+    auth = request.authorization
+    if (
+        not auth
+        or auth.username != name
+        or not hmac.compare_digest(auth.password or "", state_token(name))
+    ):
+        return "Unauthorized", 401, {"WWW-Authenticate": 'Basic realm="tfstate"'}
+
+    lock = _current_state_lock(name)
+
+    if request.method == "GET":
+        state = (
+            TerraformState.query.filter_by(name=name)
+            .order_by(TerraformState.version.desc())
+            .first()
+        )
+        if not state:
+            return "", 404
+        return _state_response(zlib.decompress(state.data), 200)
+
+    if request.method == "LOCK":
+        info = request.get_json(silent=True, force=True) or {}
+        if lock:
+            return _state_response(lock.info_json, 423)
+        db.session.add(TerraformStateLock(
+            name=name,
+            lock_id=str(info.get("ID", "")),
+            info_json=json.dumps(info),
+        ))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another LOCK got in between the check and the insert
+            db.session.rollback()
+            lock = _current_state_lock(name)
+            return _state_response(lock.info_json if lock else "{}", 423)
+        return _state_response(json.dumps(info), 200)
+
+    if request.method == "UNLOCK":
+        info = request.get_json(silent=True, force=True) or {}
+        if lock:
+            # An empty ID is `terraform force-unlock`
+            if info.get("ID") and info.get("ID") != lock.lock_id:
+                return _state_response(lock.info_json, 409)
+            db.session.delete(lock)
+            db.session.commit()
+        return "", 200
+
+    # POST / DELETE must come from the lock holder while the state is locked
+    if lock and request.args.get("ID", lock.lock_id) != lock.lock_id:
+        return _state_response(lock.info_json, 409)
+
+    if request.method == "DELETE":
+        TerraformState.query.filter_by(name=name).delete()
+        db.session.commit()
+        return "", 200
+
+    # POST: store a new version
+    raw = request.get_data()
+    md5 = hashlib.md5(raw).hexdigest()
+
+    sent_md5 = request.headers.get("Content-MD5")
+    if sent_md5 and base64.b64decode(sent_md5).hex() != md5:
+        return "Content-MD5 mismatch", 400
+
+    try:
+        serial = json.loads(raw).get("serial")
+    except (ValueError, AttributeError):
+        return "State must be JSON", 400
+
+    latest = (
+        db.session.query(db.func.max(TerraformState.version))
+        .filter(TerraformState.name == name)
+        .scalar()
+    ) or 0
+    db.session.add(TerraformState(
+        name=name,
+        version=latest + 1,
+        serial=serial,
+        md5=md5,
+        size=len(raw),
+        data=zlib.compress(raw, 6),
+    ))
+
+    # Keep the most recent STATE_HISTORY_LIMIT versions
+    cutoff = latest + 1 - app.config["STATE_HISTORY_LIMIT"]
+    if cutoff > 0:
+        TerraformState.query.filter(
+            TerraformState.name == name, TerraformState.version <= cutoff
+        ).delete()
+
+    db.session.commit()
+    return "", 200
+
+
+@app.route("/jobs/<int:job_id>/state/versions")
+@login_required
+def job_state_versions(job_id):
+    user_id = session.get("user_id")
+    job = Job.query.filter_by(id=job_id, user_id=user_id).first()
+
+    if not job:
+        return jsonify({"errors": ["Job not found or unauthorized."]}), 404
+
+    name = f"job_{job.id}"
+    versions = (
+        TerraformState.query.filter_by(name=name)
+        .order_by(TerraformState.version.desc())
+        .all()
+    )
+    lock = _current_state_lock(name)
+
+    return jsonify({
+        "name": name,
+        "locked": bool(lock),
+        "lock": json.loads(lock.info_json) if lock else None,
+        "versions": [
+            {
+                "version": state.version,
+                "serial": state.serial,
+                "md5": state.md5,
+                "size": state.size,
+                "stored_size": len(state.data),
+                "created_at": state.created_at.isoformat() if state.created_at else None,
+            }
+            for state in versions
+        ],
+    })
+
+
+# -------------------------
+# Drift Detection Routes
+# -------------------------
+
+@app.route("/drift")
+@login_required
+def drift_summary():
+    """
+    Drift status of your live jobs: counts per status plus the latest result per job.
+    """
+    user_id = session.get("user_id")
+    jobs = (
+        Job.query.filter_by(user_id=user_id, status="Success")
+        .order_by(Job.drift_checked_at.desc(), Job.id.desc())
+        .all()
+    )
+
+    counts = {}
+    for job in jobs:
+        key = job.drift_status or "Unchecked"
+        counts[key] = counts.get(key, 0) + 1
+
+    latest = {}
+    job_ids = [job.id for job in jobs if job.drift_status == "Drifted"]
+    if job_ids:
+        for check in DriftCheck.query.filter(DriftCheck.job_id.in_(job_ids)).order_by(DriftCheck.id):
+            latest[check.job_id] = json.loads(check.changed_json or "[]")
+
+    with ACTIVE_JOBS_LOCK:
+        checking = sum(job.id in DRIFT_CHECKS for job in jobs)
+
+    return jsonify({
+        "scan_running": bool(checking),
+        "checks_pending": checking,
+        "counts": counts,
+        "jobs": [
+            {
+                "id": job.id,
+                "template": job.template_name,
+                "mode": job.mode,
+                "region": job.aws_region,
+                "drift_status": job.drift_status,
+                "checked_at": job.drift_checked_at.isoformat() if job.drift_checked_at else None,
+                "changed": latest.get(job.id, []),
+            }
+            for job in jobs
+        ],
+    })
+
+
+@app.route("/drift/scan", methods=["POST"])
+@login_required
+def start_drift_scan():
+    """
+    Check your live jobs for drift in the background, with the given credentials.
+    Only jobs deployed with the same access key are checked; jobs checked
+    recently are skipped unless force=1.
+    """
+    user_id = session.get("user_id")
+    payload = request.get_json(silent=True) or request.form
+    aws_access_key = _field(payload, "aws_access_key")
+    aws_secret_key = _field(payload, "aws_secret_key")
+    aws_region = _field(payload, "aws_region") or "ap-south-1"
+    force = _field(payload, "force") in ("1", "true", "True")
+
+    if not aws_access_key or not aws_secret_key:
+        return jsonify({"errors": ["AWS credentials are required for a drift scan."]}), 400
+
+    fingerprint = credential_fingerprint(aws_access_key)
+    controls = drift_candidates(fingerprint, user_id=user_id, force=force)
+    other_credentials = Job.query.filter(
+        Job.user_id == user_id,
+        Job.status == "Success",
+        db.or_(Job.credential_fingerprint.is_(None), Job.credential_fingerprint != fingerprint),
+    ).count()
+
+    start_job_task(arun_drift_scan(controls, aws_access_key, aws_secret_key, aws_region), "Drift scan")
+
+    return jsonify({"queued": len(controls), "other_credentials": other_credentials}), 202
+
+
+@app.route("/governor")
+@login_required
+def governor_status():
+    """
+    Live view of the concurrency governor: per (access key fingerprint, region)
+    active / waiting runs, current limit and -parallelism, throttle events.
+    Admins see every group; other users only the keys they deployed with.
+    """
+    groups = GOVERNOR.snapshot()
+    if session.get("user_email") not in app.config["ADMIN_EMAILS"]:
+        own = {
+            fingerprint
+            for (fingerprint,) in db.session.query(Job.credential_fingerprint)
+            .filter(Job.user_id == session.get("user_id"), Job.credential_fingerprint.isnot(None))
+            .distinct()
+        }
+        groups = [group for group in groups if group["key"][0] in own]
+
+    return jsonify({"groups": groups})
+
+
 # Placeholder routes for next steps
 @app.route("/deploy/template", methods=["GET", "POST"])
 @login_required
@@ -388,15 +2925,7 @@ def deploy_template():
     - Each template requires a different set of variables
     """
 
-    available_templates = [
-        {"id": "web_server", "label": "Web Server – Single EC2 Instance"},
-        {"id": "vpc_basic", "label": "VPC – Public/Private Subnets"},
-        {"id": "s3_cloudfront", "label": "Static Website – S3 + CloudFront"},
-        {"id": "two_tier_app", "label": "Two-Tier App – EC2 + RDS"},
-        {"id": "eks_basic", "label": "EKS Cluster – Basic Managed Node Group"},
-        {"id": "alb_asg", "label": "ALB + ASG – Highly Available Web App"},
-        {"id": "secure_web_hosting", "label": "Secure Web Hosting – Hardened EC2 Web Server"},
-    ]
+    available_templates = AVAILABLE_TEMPLATES
 
     if request.method == "POST":
         template_id = request.form.get("template_id")
@@ -414,214 +2943,368 @@ def deploy_template():
             flash("AWS credentials are required.", "danger")
             return render_template("deploy_template.html", templates=available_templates)
 
-        # Collect template specific fields
-        instance_name = request.form.get("instance_name", "").strip()
-        key_pair_name = request.form.get("key_pair_name", "").strip()
+        tf_vars, error = build_template_vars(template_id, request.form, aws_region)
+        if error:
+            flash(error, "danger")
+            return render_template("deploy_template.html", templates=available_templates)
 
-        vpc_cidr = request.form.get("vpc_cidr", "").strip()
-        public_subnet_1_cidr = request.form.get("public_subnet_1_cidr", "").strip()
-        public_subnet_2_cidr = request.form.get("public_subnet_2_cidr", "").strip()
-        private_subnet_1_cidr = request.form.get("private_subnet_1_cidr", "").strip()
-        private_subnet_2_cidr = request.form.get("private_subnet_2_cidr", "").strip()
+        content_hash = template_content_hash(template_source_dir(template_id))
+        error = rejected_content_message(content_hash, f"Template '{template_id}'")
+        if error:
+            flash(error, "danger")
+            return render_template("deploy_template.html", templates=available_templates)
 
-        s3_bucket_name = request.form.get("s3_bucket_name", "").strip()
+        # Create Job
+        user_id = session.get("user_id")
+        job = Job(
+            user_id=user_id,
+            mode="template",
+            template_name=template_id,
+            aws_region=aws_region,
+            content_hash=content_hash,
+            credential_fingerprint=credential_fingerprint(aws_access_key),
+            status="Queued",
+        )
+        db.session.add(job)
+        db.session.commit()
 
-        tf_vars = {}
+        # Runs in the background on the Terraform runner's event loop
+        start_job_task(
+            arun_template_job(job.id, template_id, tf_vars, aws_access_key, aws_secret_key, aws_region),
+            f"Job #{job.id}",
+        )
 
-        # Per-template validation + mapping
-        if template_id == "web_server":
-            if not instance_name or not key_pair_name:
-                flash("Instance name and key pair are required for Web Server template.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
+        flash(f"Job #{job.id} started for template '{template_id}'. Logs will update in real-time.", "info")
+        return redirect(url_for("dashboard"))
 
-            tf_vars = {
-                "instance_name": instance_name,
-                "key_pair_name": key_pair_name,
-                "aws_region": aws_region,
-            }
+    # IMPORTANT: GET pe yeh line honi hi chahiye
+    return render_template("deploy_template.html", templates=available_templates)
 
-        elif template_id == "vpc_basic":
-            required_vpc_fields = [
-                vpc_cidr,
-                public_subnet_1_cidr,
-                public_subnet_2_cidr,
-                private_subnet_1_cidr,
-                private_subnet_2_cidr,
-            ]
-            if not all(required_vpc_fields):
-                flash("All VPC and subnet CIDRs are required for VPC template.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
-
-            tf_vars = {
-                "aws_region": aws_region,
-                "vpc_cidr": vpc_cidr,
-                "public_subnet_1_cidr": public_subnet_1_cidr,
-                "public_subnet_2_cidr": public_subnet_2_cidr,
-                "private_subnet_1_cidr": private_subnet_1_cidr,
-                "private_subnet_2_cidr": private_subnet_2_cidr,
-            }
+@app.route("/deploy/batch", methods=["POST"])
+@login_required
+def deploy_batch():
+    """
+    Batch / fan-out deploy (JSON API):
+    - One template + base fields, fanned out over a matrix of field
+      overrides and/or a list of regions
+    - Every item is validated up front; nothing is queued unless all pass
+    - Jobs are created as one JobGroup and run with bounded concurrency
+
+    Body:
+        {"template_id", "aws_access_key", "aws_secret_key", "aws_region",
+         "fields": {...}, "matrix": [{...}, ...], "regions": [...],
+         "max_concurrency": 4}
+    """
+    payload = request.get_json(silent=True) or {}
 
-        elif template_id == "s3_cloudfront":
-            if not s3_bucket_name:
-                flash("Bucket name is required for S3 + CloudFront template.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
+    template_id = _field(payload, "template_id")
+    aws_access_key = _field(payload, "aws_access_key")
+    aws_secret_key = _field(payload, "aws_secret_key")
+    default_region = _field(payload, "aws_region") or "ap-south-1"
+    base_fields = payload.get("fields") or {}
+    matrix = payload.get("matrix") or [{}]
+    regions = payload.get("regions") or []
 
-            tf_vars = {
-                "aws_region": aws_region,
-                "bucket_name": s3_bucket_name,
-            }
+    if not template_id:
+        return jsonify({"errors": ["template_id is required."]}), 400
 
-        elif template_id == "two_tier_app":
-            if not instance_name or not key_pair_name:
-                flash("Instance name and key pair are required for Two-Tier App template.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
-
-            db_name = request.form.get("db_name", "").strip()
-            db_username = request.form.get("db_username", "").strip()
-            db_password = request.form.get("db_password", "").strip()
-
-            if not db_name or not db_username or not db_password:
-                flash("DB name, username, and password are required for Two-Tier App template.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
-
-            tf_vars = {
-                "aws_region": aws_region,
-                "instance_name": instance_name,
-                "key_pair_name": key_pair_name,
-                "db_name": db_name,
-                "db_username": db_username,
-                "db_password": db_password,
-            }
-        elif template_id == "eks_basic":
-            cluster_name = request.form.get("eks_cluster_name", "").strip()
-            node_instance_type = request.form.get("eks_node_instance_type", "").strip()
-            desired_size = request.form.get("eks_desired_size", "").strip()
-            min_size = request.form.get("eks_min_size", "").strip()
-            max_size = request.form.get("eks_max_size", "").strip()
+    if not aws_access_key or not aws_secret_key:
+        return jsonify({"errors": ["AWS credentials are required."]}), 400
 
-            if not cluster_name:
-                flash("Cluster name is required for EKS template.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
+    if not isinstance(base_fields, dict) or not isinstance(matrix, list) or not isinstance(regions, list):
+        return jsonify({"errors": ["fields must be an object, matrix and regions must be lists."]}), 400
 
-            if not node_instance_type:
-                node_instance_type = "t3.small"
+    try:
+        max_concurrency = int(payload.get("max_concurrency") or 4)
+    except (TypeError, ValueError):
+        return jsonify({"errors": ["max_concurrency must be an integer."]}), 400
+    max_concurrency = max(1, min(max_concurrency, app.config["BATCH_MAX_CONCURRENCY"]))
+
+    # Expand matrix x regions and validate every item in one pass
+    items = []
+    errors = []
+    for index, overrides in enumerate(matrix):
+        if not isinstance(overrides, dict):
+            errors.append(f"matrix[{index}]: must be an object.")
+            continue
+
+        fields = dict(base_fields)
+        fields.update(overrides)
+        item_regions = regions or [_field(fields, "aws_region") or default_region]
+
+        for region in item_regions:
+            region = str(region).strip() or default_region
+            tf_vars, error = build_template_vars(template_id, fields, region)
+            if error:
+                errors.append(f"matrix[{index}] / {region}: {error}")
+            else:
+                items.append((tf_vars, region))
+
+    if not errors and len(items) > app.config["BATCH_MAX_JOBS"]:
+        errors.append(f"Batch expands to {len(items)} jobs; the limit is {app.config['BATCH_MAX_JOBS']}.")
+
+    if errors:
+        return jsonify({"errors": errors}), 400
+
+    content_hash = template_content_hash(template_source_dir(template_id))
+    error = rejected_content_message(content_hash, f"Template '{template_id}'")
+    if error:
+        return jsonify({"errors": [error]}), 400
 
-            # Basic check for scaling numbers
-            if not (desired_size and min_size and max_size):
-                flash("Desired, min, and max node counts are required for EKS template.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
+    user_id = session.get("user_id")
+    group = JobGroup(user_id=user_id, template_name=template_id, max_concurrency=max_concurrency)
+    db.session.add(group)
+    db.session.flush()
 
-            try:
-                desired_size = int(desired_size)
-                min_size = int(min_size)
-                max_size = int(max_size)
-            except ValueError:
-                flash("EKS node sizes must be integers.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
-
-            tf_vars = {
-                "aws_region": aws_region,
-                "cluster_name": cluster_name,
-                "node_instance_type": node_instance_type,
-                "desired_size": desired_size,
-                "min_size": min_size,
-                "max_size": max_size,
-            }
-        elif template_id == "alb_asg":
-            # Reuse instance_name + key_pair_name fields
-            if not instance_name or not key_pair_name:
-                flash("Instance name and key pair are required for ALB + ASG template.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
+    jobs = []
+    for tf_vars, region in items:
+        job = Job(
+            user_id=user_id,
+            mode="template",
+            template_name=template_id,
+            aws_region=region,
+            group_id=group.id,
+            content_hash=content_hash,
+            credential_fingerprint=credential_fingerprint(aws_access_key),
+            status="Queued",
+        )
+        db.session.add(job)
+        jobs.append(job)
+    db.session.commit()
 
-            asg_instance_type = request.form.get("asg_instance_type", "").strip() or "t2.micro"
-            asg_desired = request.form.get("asg_desired_capacity", "").strip()
-            asg_min = request.form.get("asg_min_size", "").strip()
-            asg_max = request.form.get("asg_max_size", "").strip()
+    run_items = [
+        (job.id, template_id, tf_vars, region)
+        for job, (tf_vars, region) in zip(jobs, items)
+    ]
+    start_job_task(
+        arun_group(group.id, run_items, aws_access_key, aws_secret_key, max_concurrency),
+        f"Batch group #{group.id}",
+    )
 
-            if not (asg_desired and asg_min and asg_max):
-                flash("ASG desired, min, and max sizes are required for ALB + ASG template.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
+    return jsonify(group_summary(group)), 202
 
-            try:
-                asg_desired = int(asg_desired)
-                asg_min = int(asg_min)
-                asg_max = int(asg_max)
-            except ValueError:
-                flash("ASG sizes must be integers.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
-
-            tf_vars = {
-                "aws_region": aws_region,
-                "instance_name": instance_name,
-                "key_pair_name": key_pair_name,
-                "asg_instance_type": asg_instance_type,
-                "asg_desired_capacity": asg_desired,
-                "asg_min_size": asg_min,
-                "asg_max_size": asg_max,
-            }
 
-        elif template_id == "secure_web_hosting":
-            if not instance_name or not key_pair_name:
-                flash("Instance name and key pair are required for Secure Web Hosting template.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
-
-            allowed_ssh_cidr = request.form.get("allowed_ssh_cidr", "").strip() or "0.0.0.0/0"
-            secure_instance_type = request.form.get("secure_instance_type", "").strip() or "t3.micro"
-
-            github_repo_url = request.form.get("github_repo_url", "").strip()
-            github_branch = request.form.get("github_branch", "").strip() or "main"
-            app_root_subdir = request.form.get("app_root_subdir", "").strip()
-            domain_name = request.form.get("domain_name", "").strip()
-
-            if not github_repo_url:
-                flash("GitHub repository URL is required for Secure Web Hosting template.", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
-
-            if not domain_name:
-                flash("Domain name is required for Secure Web Hosting template (it can be planned/future domain).", "danger")
-                return render_template("deploy_template.html", templates=available_templates)
-
-            tf_vars = {
-                "aws_region": aws_region,
-                "instance_name": instance_name,
-                "key_pair_name": key_pair_name,
-                "allowed_ssh_cidr": allowed_ssh_cidr,
-                "instance_type": secure_instance_type,
-                "github_repo_url": github_repo_url,
-                "github_branch": github_branch,
-                "app_root_subdir": app_root_subdir,
-                "domain_name": domain_name,
-            }
+@app.route("/groups/<int:group_id>")
+@login_required
+def view_group(group_id):
+    user_id = session.get("user_id")
+    group = JobGroup.query.filter_by(id=group_id, user_id=user_id).first()
 
+    if not group:
+        return jsonify({"errors": ["Group not found or unauthorized."]}), 404
 
-        else:
-            flash("Unknown template selected.", "danger")
-            return render_template("deploy_template.html", templates=available_templates)
+    return jsonify(group_summary(group))
 
-        # Create Job
-        user_id = session.get("user_id")
-        job = Job(
+
+@app.route("/groups/<int:group_id>/destroy", methods=["POST"])
+@login_required
+def destroy_group(group_id):
+    """
+    Bulk destroy every finished job of a batch group, in the background,
+    with the same concurrency limit the group was deployed with. Jobs that
+    never got a workspace (cancelled while queued, failed pre-flight) are
+    left alone.
+    """
+    user_id = session.get("user_id")
+    group = JobGroup.query.filter_by(id=group_id, user_id=user_id).first()
+
+    if not group:
+        return jsonify({"errors": ["Group not found or unauthorized."]}), 404
+
+    payload = request.get_json(silent=True) or request.form
+    aws_access_key = _field(payload, "aws_access_key")
+    aws_secret_key = _field(payload, "aws_secret_key")
+    aws_region = _field(payload, "aws_region") or "ap-south-1"
+
+    if not aws_access_key or not aws_secret_key:
+        return jsonify({"errors": ["AWS credentials are required for destroy action."]}), 400
+
+    jobs = group.jobs.filter(
+        Job.status.notin_(["Queued", "Running", "Destroying", "Destroyed"]),
+        Job.workspace_created.is_(True),
+    ).all()
+    for job in jobs:
+        job.status = "Destroying"
+    db.session.commit()
+
+    start_job_task(
+        adestroy_group([job.id for job in jobs], aws_access_key, aws_secret_key, aws_region, group.max_concurrency),
+        f"Destroy of batch group #{group.id}",
+    )
+
+    return jsonify(group_summary(group)), 202
+
+
+@app.route("/stacks", methods=["POST"])
+@login_required
+def deploy_stack():
+    """
+    Stack deploy (JSON API):
+    - `nodes` maps a node name to a template deployment
+    - `depends_on` lists upstream nodes; `inputs` maps a Terraform variable
+      of this node to an upstream output ("<node>.<output_name>")
+    - Everything is validated up front, then the DAG runs in the background
+
+    Body:
+        {"name", "aws_access_key", "aws_secret_key", "aws_region", "max_concurrency",
+         "nodes": {"network": {"template_id": "vpc_basic", "fields": {...}},
+                   "app": {"template_id": "alb_asg", "fields": {...},
+                           "depends_on": ["network"],
+                           "inputs": {"vpc_id": "network.vpc_id"}}}}
+    """
+    payload = request.get_json(silent=True) or {}
+
+    name = _field(payload, "name") or "stack"
+    aws_access_key = _field(payload, "aws_access_key")
+    aws_secret_key = _field(payload, "aws_secret_key")
+    default_region = _field(payload, "aws_region") or "ap-south-1"
+    raw_nodes = payload.get("nodes")
+
+    if not aws_access_key or not aws_secret_key:
+        return jsonify({"errors": ["AWS credentials are required."]}), 400
+
+    if not isinstance(raw_nodes, dict) or not raw_nodes:
+        return jsonify({"errors": ["nodes must be a non-empty object."]}), 400
+
+    if len(raw_nodes) > app.config["BATCH_MAX_JOBS"]:
+        return jsonify({"errors": [f"A stack can have at most {app.config['BATCH_MAX_JOBS']} nodes."]}), 400
+
+    try:
+        max_concurrency = int(payload.get("max_concurrency") or 4)
+    except (TypeError, ValueError):
+        return jsonify({"errors": ["max_concurrency must be an integer."]}), 400
+    max_concurrency = max(1, min(max_concurrency, app.config["BATCH_MAX_CONCURRENCY"]))
+
+    nodes = {}
+    node_vars = {}
+    node_hashes = {}
+    errors = []
+    for node_name, raw in raw_nodes.items():
+        if not isinstance(raw, dict):
+            errors.append(f"{node_name}: must be an object.")
+            continue
+
+        template_id = _field(raw, "template_id")
+        region = _field(raw, "aws_region") or default_region
+        fields = raw.get("fields") or {}
+        depends_on = raw.get("depends_on") or []
+        inputs = raw.get("inputs") or {}
+
+        if not isinstance(fields, dict) or not isinstance(depends_on, list) or not isinstance(inputs, dict):
+            errors.append(f"{node_name}: fields/inputs must be objects and depends_on a list.")
+            continue
+
+        tf_vars, error = build_template_vars(template_id, fields, region)
+        if error:
+            errors.append(f"{node_name}: {error}")
+            continue
+
+        content_hash = template_content_hash(template_source_dir(template_id))
+        error = rejected_content_message(content_hash, f"Template '{template_id}'")
+        if error:
+            errors.append(f"{node_name}: {error}")
+            continue
+
+        depends_on = [str(dep) for dep in depends_on]
+        for var_name, ref in inputs.items():
+            upstream, _, output_name = str(ref).partition(".")
+            if not output_name:
+                errors.append(f"{node_name}: input '{var_name}' must look like '<node>.<output>'.")
+            elif upstream not in depends_on:
+                # An input implies a dependency on the node producing it
+                depends_on.append(upstream)
+
+        nodes[node_name] = {
+            "template_id": template_id,
+            "aws_region": region,
+            "depends_on": depends_on,
+            "inputs": {str(k): str(v) for k, v in inputs.items()},
+        }
+        node_vars[node_name] = tf_vars
+        node_hashes[node_name] = content_hash
+
+    if not errors:
+        try:
+            topological_order(_stack_deps(nodes))
+        except ValueError as e:
+            errors.append(str(e))
+
+    if errors:
+        return jsonify({"errors": errors}), 400
+
+    user_id = session.get("user_id")
+    stack = Stack(
+        user_id=user_id,
+        name=name,
+        definition_json=json.dumps(nodes),
+        max_concurrency=max_concurrency,
+    )
+    db.session.add(stack)
+    db.session.flush()
+
+    for node_name, node in nodes.items():
+        db.session.add(Job(
             user_id=user_id,
             mode="template",
-            template_name=template_id,
+            template_name=node["template_id"],
+            aws_region=node["aws_region"],
+            stack_id=stack.id,
+            stack_node=node_name,
+            content_hash=node_hashes[node_name],
+            credential_fingerprint=credential_fingerprint(aws_access_key),
             status="Queued",
-        )
-        db.session.add(job)
-        db.session.commit()
+        ))
+    db.session.commit()
 
-        # Start background thread
-        t = threading.Thread(
-            target=run_template_job_async,
-            args=(job.id, template_id, tf_vars, aws_access_key, aws_secret_key, aws_region),
-            daemon=True,
-        )
-        t.start()
+    start_job_task(arun_stack(stack.id, node_vars, aws_access_key, aws_secret_key), f"Stack #{stack.id}")
 
-        flash(f"Job #{job.id} started for template '{template_id}'. Logs will update in real-time.", "info")
-        return redirect(url_for("dashboard"))
+    return jsonify(stack_summary(stack)), 202
+
+
+@app.route("/stacks/<int:stack_id>")
+@login_required
+def view_stack(stack_id):
+    user_id = session.get("user_id")
+    stack = Stack.query.filter_by(id=stack_id, user_id=user_id).first()
+
+    if not stack:
+        return jsonify({"errors": ["Stack not found or unauthorized."]}), 404
+
+    return jsonify(stack_summary(stack))
+
+
+@app.route("/stacks/<int:stack_id>/destroy", methods=["POST"])
+@login_required
+def destroy_stack(stack_id):
+    user_id = session.get("user_id")
+    stack = Stack.query.filter_by(id=stack_id, user_id=user_id).first()
+
+    if not stack:
+        return jsonify({"errors": ["Stack not found or unauthorized."]}), 404
+
+    payload = request.get_json(silent=True) or request.form
+    aws_access_key = _field(payload, "aws_access_key")
+    aws_secret_key = _field(payload, "aws_secret_key")
+
+    if not aws_access_key or not aws_secret_key:
+        return jsonify({"errors": ["AWS credentials are required for destroy action."]}), 400
+
+    if stack.jobs.filter(Job.status.in_(["Queued", "Running", "Destroying"])).count():
+        return jsonify({"errors": ["Stack still has queued or running jobs."]}), 409
+
+    previous_status = {}
+    for job in stack.jobs.filter(Job.status.notin_(["Skipped", "Destroyed"])):
+        previous_status[job.id] = job.status
+        job.status = "Destroying"
+    db.session.commit()
+
+    start_job_task(
+        adestroy_stack(stack.id, previous_status, aws_access_key, aws_secret_key),
+        f"Destroy of stack #{stack.id}",
+    )
+
+    return jsonify(stack_summary(stack)), 202
 
-    # IMPORTANT: GET pe yeh line honi hi chahiye
-    return render_template("deploy_template.html", templates=available_templates)
 
 @app.route("/deploy/custom", methods=["GET", "POST"])
 @login_required
@@ -654,23 +3337,36 @@ def deploy_custom():
         zip_path = os.path.join(UPLOAD_DIR, f"job_upload_{datetime.utcnow().timestamp()}_{filename}")
         file.save(zip_path)
 
+        content_hash = zip_content_hash(zip_path)
+        if content_hash is None:
+            os.remove(zip_path)
+            flash("The uploaded file is not a valid ZIP archive.", "danger")
+            return render_template("custom.html")
+
+        error = rejected_content_message(content_hash, "This Terraform project")
+        if error:
+            os.remove(zip_path)
+            flash(error, "danger")
+            return render_template("custom.html")
+
         user_id = session.get("user_id")
         job = Job(
             user_id=user_id,
             mode="custom",
             template_name=None,
+            aws_region=aws_region,
+            content_hash=content_hash,
+            credential_fingerprint=credential_fingerprint(aws_access_key),
             status="Queued",
         )
         db.session.add(job)
         db.session.commit()
 
-        # Start background thread
-        t = threading.Thread(
-            target=run_custom_job_async,
-            args=(job.id, zip_path, aws_access_key, aws_secret_key, aws_region),
-            daemon=True,
+        # Runs in the background on the Terraform runner's event loop
+        start_job_task(
+            arun_custom_job(job.id, zip_path, aws_access_key, aws_secret_key, aws_region),
+            f"Custom job #{job.id}",
         )
-        t.start()
 
         flash(f"Custom job #{job.id} started. Logs will update in real-time.", "info")
         return redirect(url_for("dashboard"))
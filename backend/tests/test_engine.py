@@ -0,0 +1,215 @@
+import asyncio
+import os
+import shutil
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BACKEND_DIR)
+
+from utils.dag import arun_dag  # noqa: E402
+from utils.governor import ConcurrencyGovernor  # noqa: E402
+from utils.terraform_runner import JobControl, arun_terraform_template_job, run_sync  # noqa: E402
+
+FAKE_TERRAFORM_DIR = os.path.join(BACKEND_DIR, "tools", "fake_terraform")
+TEMPLATES_DIR = os.path.join(BACKEND_DIR, "..", "infra", "templates", "aws")
+
+
+# -------------------------
+# Concurrency governor
+# -------------------------
+
+def test_throttled_run_halves_limit_and_parallelism():
+    governor = ConcurrencyGovernor(max_active=4, max_parallelism=10, min_parallelism=2)
+    assert run_sync(governor.aacquire("k")) == 10
+
+    governor.release("k", throttled=True)
+    [group] = governor.snapshot()
+    assert (group["limit"], group["parallelism"], group["throttle_events"]) == (2, 5, 1)
+    assert group["active"] == 0
+
+    for _ in range(3):
+        run_sync(governor.aacquire("k"))
+        governor.release("k", throttled=True)
+    [group] = governor.snapshot()
+    assert (group["limit"], group["parallelism"]) == (1, 2)
+
+
+def test_clean_run_grows_limit_back_up_to_max():
+    governor = ConcurrencyGovernor(max_active=3, max_parallelism=4, min_parallelism=2)
+    run_sync(governor.aacquire("k"))
+    governor.release("k", throttled=True)
+
+    for _ in range(5):
+        run_sync(governor.aacquire("k"))
+        governor.release("k", throttled=False)
+    [group] = governor.snapshot()
+    assert (group["limit"], group["parallelism"]) == (3, 4)
+
+
+def test_release_without_outcome_leaves_limits_alone():
+    governor = ConcurrencyGovernor(max_active=3, max_parallelism=10)
+    run_sync(governor.aacquire("k"))
+    governor.release("k", throttled=True)
+    before = governor.snapshot()[0]
+
+    run_sync(governor.aacquire("k"))
+    governor.release("k", throttled=None)
+    after = governor.snapshot()[0]
+    assert (after["limit"], after["parallelism"], after["active"]) == (before["limit"], before["parallelism"], 0)
+
+
+def test_full_group_does_not_hold_up_other_groups():
+    governor = ConcurrencyGovernor(max_active=1)
+
+    async def scenario():
+        assert await governor.aacquire("a") is not None
+        waiter = asyncio.ensure_future(governor.aacquire("a", poll_seconds=0.01))
+        other = await asyncio.wait_for(governor.aacquire("b", poll_seconds=0.01), timeout=1)
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+
+        governor.release("a", throttled=False)
+        return other, await asyncio.wait_for(waiter, timeout=1)
+
+    other, waited = run_sync(scenario())
+    assert other is not None and waited is not None
+
+
+def test_acquire_gives_up_when_aborted():
+    governor = ConcurrencyGovernor(max_active=1)
+    run_sync(governor.aacquire("k"))
+
+    assert run_sync(governor.aacquire("k", should_abort=lambda: True, poll_seconds=0.01)) is None
+    assert governor.snapshot()[0]["waiting"] == 0
+
+
+# -------------------------
+# Stack DAG runner
+# -------------------------
+
+def _run_dag(deps, failing=(), reverse=False):
+    order = []
+
+    async def run_node(name):
+        order.append(name)
+        await asyncio.sleep(0)
+        return name not in failing
+
+    results = run_sync(arun_dag(deps, run_node, max_workers=2, reverse=reverse))
+    return results, order
+
+
+def test_dag_skips_everything_downstream_of_a_failure():
+    deps = {"net": [], "db": ["net"], "web": ["db"], "cdn": ["net"]}
+    results, order = _run_dag(deps, failing={"db"})
+
+    assert results == {"net": "success", "db": "failed", "web": "skipped", "cdn": "success"}
+    assert "web" not in order
+
+
+def test_dag_reverse_runs_dependents_first():
+    deps = {"net": [], "db": ["net"], "web": ["db", "net"]}
+    results, order = _run_dag(deps, reverse=True)
+
+    assert order == ["web", "db", "net"]
+    assert set(results.values()) == {"success"}
+
+
+def test_dag_reverse_keeps_dependencies_of_a_failed_node():
+    deps = {"net": [], "web": ["net"]}
+    results, order = _run_dag(deps, failing={"web"}, reverse=True)
+
+    assert results == {"web": "failed", "net": "skipped"}
+    assert order == ["web"]
+
+
+# -------------------------
+# Export resume tokens
+# -------------------------
+
+@pytest.fixture(scope="module")
+def cloudinfra_app(tmp_path_factory):
+    # Never touch the bundled cloudinfra.db
+    os.environ["CLOUDINFRA_DB_PATH"] = str(tmp_path_factory.mktemp("db") / "cloudinfra.db")
+    os.environ.setdefault("CLOUDINFRA_STATE_SECRET", "test-state-secret")
+    import app
+    return app
+
+
+def test_export_token_round_trip(cloudinfra_app):
+    assert cloudinfra_app.parse_export_token(cloudinfra_app.export_token(1234)) == 1234
+
+
+@pytest.mark.parametrize("token", ["", "not-base64!", "am9iOmFiYw", "c3RhY2s6MTI"])
+def test_bad_export_tokens_are_rejected(cloudinfra_app, token):
+    # "am9iOmFiYw" is "job:abc", "c3RhY2s6MTI" is "stack:12"
+    assert cloudinfra_app.parse_export_token(token) is None
+
+
+# -------------------------
+# Governor + runner against the fake terraform
+# -------------------------
+
+@pytest.fixture
+def fake_terraform(tmp_path, monkeypatch):
+    """
+    A scratch infra/ layout with one template, and the fake terraform first
+    on PATH. Its per key + region run counters live in tmp_path too.
+    """
+    shutil.copytree(os.path.join(TEMPLATES_DIR, "web_server"), tmp_path / "infra" / "templates" / "aws" / "web_server")
+    (tmp_path / "backend").mkdir()
+
+    monkeypatch.setenv("PATH", FAKE_TERRAFORM_DIR + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("TMPDIR", str(tmp_path))
+    monkeypatch.setenv("FAKE_TF_RATE_LIMIT", "1")
+    monkeypatch.setenv("FAKE_TF_SLEEP", "2")
+    return tmp_path
+
+
+def test_throttling_shrinks_only_the_throttled_group(fake_terraform):
+    governor = ConcurrencyGovernor(max_active=3, max_parallelism=10)
+    region = "ap-south-1"
+    job_ids = iter(range(1, 100))
+
+    async def deploy(access_key):
+        key = (access_key, region)
+        control = JobControl()
+        control.parallelism = await governor.aacquire(key, poll_seconds=0.1)
+        try:
+            success, _, _ = await arun_terraform_template_job(
+                job_id=next(job_ids),
+                template_name="web_server",
+                variables={},
+                aws_access_key=access_key,
+                aws_secret_key="secret",
+                aws_region=region,
+                base_dir=str(fake_terraform / "backend"),
+                logs_dir=str(fake_terraform / "logs"),
+                control=control,
+            )
+        finally:
+            governor.release(key, throttled=control.throttled)
+        return success
+
+    async def scenario():
+        # Three overlapping applies on one key trip the fake's limit of one;
+        # a run on another key goes through at the same time
+        first = await asyncio.gather(*(deploy(key) for key in ("AKIA_A", "AKIA_A", "AKIA_A", "AKIA_B")))
+        groups = {group["key"][0]: group for group in governor.snapshot()}
+        return first, groups
+
+    first, groups = run_sync(scenario())
+
+    assert first[:3].count(True) == 1
+    assert first[3] is True
+    assert groups["AKIA_A"]["throttle_events"] == 2
+    assert groups["AKIA_A"]["limit"] < 3
+    assert groups["AKIA_A"]["parallelism"] < 10
+    assert (groups["AKIA_B"]["limit"], groups["AKIA_B"]["parallelism"], groups["AKIA_B"]["throttle_events"]) == (3, 10, 0)
+
+    # A clean run on the throttled key grows its limit back by one
+    assert run_sync(deploy("AKIA_A")) is True
+    recovered = {group["key"][0]: group for group in governor.snapshot()}["AKIA_A"]
+    assert recovered["limit"] == groups["AKIA_A"]["limit"] + 1
@@ -0,0 +1,110 @@
+import asyncio
+
+
+def topological_order(deps: dict) -> list:
+    """
+    Order the nodes of a dependency graph so every node comes after the
+    nodes it depends on.
+
+    deps: {node: [nodes it depends on]}
+
+    Raises ValueError on unknown dependencies or cycles.
+    """
+    for node, upstream in deps.items():
+        for dep in upstream:
+            if dep not in deps:
+                raise ValueError(f"'{node}' depends on unknown node '{dep}'")
+
+    order = []
+    state = {}  # node -> "visiting" / "done"
+
+    def visit(node, path):
+        if state.get(node) == "done":
+            return
+        if state.get(node) == "visiting":
+            cycle = " -> ".join(path[path.index(node):] + [node])
+            raise ValueError(f"Dependency cycle: {cycle}")
+
+        state[node] = "visiting"
+        for dep in sorted(deps[node]):
+            visit(dep, path + [node])
+        state[node] = "done"
+        order.append(node)
+
+    for node in sorted(deps):
+        visit(node, [])
+
+    return order
+
+
+def reverse_deps(deps: dict) -> dict:
+    """
+    Flip a dependency graph: each node now waits for its dependents.
+    """
+    flipped = {node: [] for node in deps}
+    for node, upstream in deps.items():
+        for dep in upstream:
+            flipped[dep].append(node)
+    return flipped
+
+
+async def arun_dag(deps: dict, run_node, max_workers: int = 4, reverse: bool = False) -> dict:
+    """
+    Run the coroutine `run_node(node) -> bool` for every node of the graph
+    as concurrent tasks on the running event loop.
+
+    - A node starts as soon as everything it depends on has succeeded
+    - Independent branches run concurrently, up to `max_workers` at a time
+    - If a node fails (or raises), everything downstream of it is skipped
+    - reverse=True walks the graph backwards (dependents first), e.g. for destroy
+
+    Returns:
+        {node: "success" | "failed" | "skipped"}
+    """
+    topological_order(deps)
+    if reverse:
+        deps = reverse_deps(deps)
+
+    results = {}
+    waiting = {node: set(upstream) for node, upstream in deps.items()}
+    running = {}
+    slots = asyncio.Semaphore(max(1, max_workers))
+
+    async def run(node):
+        async with slots:
+            return await run_node(node)
+
+    def settle_skips():
+        changed = True
+        while changed:
+            changed = False
+            for node, upstream in list(waiting.items()):
+                if any(results.get(dep) in ("failed", "skipped") for dep in upstream):
+                    results[node] = "skipped"
+                    del waiting[node]
+                    changed = True
+
+    while waiting or running:
+        settle_skips()
+
+        ready = [
+            node for node, upstream in waiting.items()
+            if all(results.get(dep) == "success" for dep in upstream)
+        ]
+        for node in sorted(ready):
+            del waiting[node]
+            running[asyncio.ensure_future(run(node))] = node
+
+        if not running:
+            break
+
+        done, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            node = running.pop(task)
+            try:
+                ok = bool(task.result())
+            except Exception:
+                ok = False
+            results[node] = "success" if ok else "failed"
+
+    return results
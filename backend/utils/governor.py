@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+
+
+class _GroupState:
+    def __init__(self, limit: int, parallelism: int):
+        self.limit = limit
+        self.parallelism = parallelism
+        self.active = 0
+        self.waiting = 0
+        self.throttle_events = 0
+        self.last_throttled_at = None
+
+
+class ConcurrencyGovernor:
+    """
+    Caps concurrent Terraform runs per group – in this app a group is
+    (access key fingerprint, region), i.e. one AWS API rate-limit bucket.
+
+    - aacquire(key) waits while the group is at its limit and returns the
+      `-parallelism` value the run should use
+    - release(key, throttled) feeds the run's outcome back: a throttled run
+      halves the group's limit and parallelism, a clean run grows them by one
+      (additive increase / multiplicative decrease). throttled=None hands the
+      slot back without an outcome, for a slot that never ran anything.
+
+    Groups are independent: a full group never delays runs of another group.
+    """
+
+    def __init__(self, max_active: int = 3, max_parallelism: int = 10, min_parallelism: int = 2):
+        self.max_active = max_active
+        self.max_parallelism = max_parallelism
+        self.min_parallelism = min_parallelism
+        self._lock = threading.Lock()
+        self._groups = {}
+
+    def _group(self, key) -> _GroupState:
+        group = self._groups.get(key)
+        if group is None:
+            group = _GroupState(self.max_active, self.max_parallelism)
+            self._groups[key] = group
+        return group
+
+    def has_capacity(self, key) -> bool:
+        with self._lock:
+            group = self._group(key)
+            return group.active < group.limit
+
+    async def aacquire(self, key, should_abort=None, poll_seconds: float = 1.0):
+        """
+        Wait for a slot in `key`'s group. Returns the parallelism to use, or
+        None if `should_abort()` became true while waiting.
+        """
+        with self._lock:
+            self._group(key).waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    group = self._group(key)
+                    if group.active < group.limit:
+                        group.active += 1
+                        return group.parallelism
+                if should_abort is not None and should_abort():
+                    return None
+                await asyncio.sleep(poll_seconds)
+        finally:
+            with self._lock:
+                self._group(key).waiting -= 1
+
+    def release(self, key, throttled: bool = None):
+        with self._lock:
+            group = self._group(key)
+            group.active = max(0, group.active - 1)
+
+            if throttled is None:
+                pass
+            elif throttled:
+                group.throttle_events += 1
+                group.last_throttled_at = time.time()
+                group.limit = max(1, group.limit // 2)
+                group.parallelism = max(self.min_parallelism, group.parallelism // 2)
+            else:
+                group.limit = min(self.max_active, group.limit + 1)
+                group.parallelism = min(self.max_parallelism, group.parallelism + 1)
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [
+                {
+                    "key": list(key) if isinstance(key, tuple) else key,
+                    "active": group.active,
+                    "waiting": group.waiting,
+                    "limit": group.limit,
+                    "parallelism": group.parallelism,
+                    "throttle_events": group.throttle_events,
+                    "last_throttled_at": group.last_throttled_at,
+                }
+                for key, group in sorted(self._groups.items(), key=lambda item: str(item[0]))
+            ]
@@ -0,0 +1,218 @@
+import os
+import asyncio
+import threading
+import time
+
+
+# Resource accounting reads Linux /proc directly; elsewhere sampling and
+# memory admission are simply disabled.
+PROC_SUPPORTED = os.path.isdir("/proc/self")
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if PROC_SUPPORTED else 4096
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if PROC_SUPPORTED else 100
+
+
+def read_proc_table() -> dict:
+    """
+    One pass over /proc: {pid: (ppid, rss_bytes, cpu_seconds)}.
+    cpu_seconds includes the time of children the process already reaped.
+    """
+    table = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue  # exited while we were scanning
+
+        # comm (field 2) may contain spaces / parentheses: split after the last ')'
+        fields = stat[stat.rfind(")") + 2:].split()
+        ppid = int(fields[1])
+        cpu_ticks = sum(int(value) for value in fields[11:15])  # utime stime cutime cstime
+        rss_pages = int(fields[21])
+        table[int(name)] = (ppid, rss_pages * _PAGE_SIZE, cpu_ticks / _CLOCK_TICKS)
+    return table
+
+
+def tree_usage(root_pid: int, table: dict, children: dict):
+    """
+    (rss_bytes, cpu_seconds) summed over a process and all its descendants,
+    or None if the process is gone.
+    """
+    if root_pid not in table:
+        return None
+
+    rss, cpu = 0, 0.0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        _, pid_rss, pid_cpu = table[pid]
+        rss += pid_rss
+        cpu += pid_cpu
+        stack.extend(children.get(pid, ()))
+    return rss, cpu
+
+
+def host_memory():
+    """
+    (total_bytes, available_bytes) from /proc/meminfo, or None.
+    """
+    if not PROC_SUPPORTED:
+        return None
+
+    values = {}
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("MemTotal", "MemAvailable"):
+                    values[key] = int(rest.split()[0]) * 1024
+    except OSError:
+        return None
+
+    if len(values) < 2:
+        return None
+    return values["MemTotal"], values["MemAvailable"]
+
+
+class ProcessTreeSampler:
+    """
+    Samples RSS and CPU of every tracked Terraform process tree (terraform
+    plus its provider plugins) with one /proc scan per interval, and keeps
+    the figures on the run's JobControl:
+
+    - rss_bytes: current tree RSS (0 between commands)
+    - peak_rss_bytes / peak_cpu_percent: highest values seen during the run
+    - cpu_seconds: CPU time of finished commands
+    """
+
+    def __init__(self, interval_seconds: float = 2.0):
+        self.interval_seconds = interval_seconds
+        self._tracked = {}  # pid -> {"control", "cpu", "at"}
+        self._lock = threading.Lock()
+        self._task = None
+
+    def track(self, pid: int, control):
+        if not PROC_SUPPORTED or control is None:
+            return
+        with self._lock:
+            self._tracked[pid] = {"control": control, "cpu": 0.0, "at": time.monotonic()}
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def untrack(self, pid: int):
+        with self._lock:
+            entry = self._tracked.pop(pid, None)
+        if entry is not None:
+            entry["control"].cpu_seconds += entry["cpu"]
+            entry["control"].rss_bytes = 0
+
+    async def _run(self):
+        while self._tracked:
+            await asyncio.sleep(self.interval_seconds)
+            table = await asyncio.to_thread(read_proc_table)
+            self.sample(table)
+
+    def sample(self, table: dict):
+        children = {}
+        for pid, (ppid, _, _) in table.items():
+            children.setdefault(ppid, []).append(pid)
+
+        now = time.monotonic()
+        with self._lock:
+            for pid, entry in self._tracked.items():
+                usage = tree_usage(pid, table, children)
+                if usage is None:
+                    continue
+
+                rss, cpu = usage
+                control = entry["control"]
+                elapsed = now - entry["at"]
+                if elapsed > 0:
+                    cpu_percent = max(0.0, (cpu - entry["cpu"]) / elapsed * 100)
+                    control.peak_cpu_percent = max(control.peak_cpu_percent, round(cpu_percent, 1))
+
+                control.rss_bytes = rss
+                control.peak_rss_bytes = max(control.peak_rss_bytes, rss)
+                entry["cpu"] = cpu
+                entry["at"] = now
+
+
+class MemoryAdmission:
+    """
+    Host-wide admission control for Terraform runs by projected memory.
+
+    A run is admitted when
+
+        host memory in use now
+        + what admitted runs are still expected to grow by
+          (expected peak - current RSS, from their JobControl)
+        + this run's expected peak
+
+    stays under `limit_percent` of host memory. The first run is always
+    admitted, so a single oversized template cannot wait forever.
+    """
+
+    def __init__(self, limit_percent: int = 85):
+        self.limit_percent = limit_percent
+        self._lock = threading.Lock()
+        self._admitted = {}  # control -> expected peak bytes
+        self._waiting = 0
+
+    def _projection(self, extra_bytes: int = 0):
+        memory = host_memory()
+        if memory is None or self.limit_percent <= 0:
+            return None, None
+
+        total, available = memory
+        growth = sum(
+            max(0, expected - control.rss_bytes)
+            for control, expected in self._admitted.items()
+        )
+        return total - available + growth + extra_bytes, total * self.limit_percent // 100
+
+    def _try_admit(self, control, expected_bytes: int) -> bool:
+        projected, limit = self._projection(expected_bytes)
+        if limit is None or not self._admitted or projected <= limit:
+            self._admitted[control] = expected_bytes
+            return True
+        return False
+
+    async def aacquire(self, control, expected_bytes: int, should_abort=None, poll_seconds: float = 2.0) -> bool:
+        """
+        Wait until the run fits. Returns False if `should_abort()` became true first.
+        """
+        with self._lock:
+            self._waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    if self._try_admit(control, expected_bytes):
+                        return True
+                if should_abort is not None and should_abort():
+                    return False
+                await asyncio.sleep(poll_seconds)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def release(self, control):
+        with self._lock:
+            self._admitted.pop(control, None)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            projected, limit = self._projection()
+            memory = host_memory()
+            return {
+                "enabled": limit is not None,
+                "limit_percent": self.limit_percent,
+                "limit_bytes": limit,
+                "total_bytes": memory[0] if memory else None,
+                "available_bytes": memory[1] if memory else None,
+                "projected_bytes": projected,
+                "admitted": len(self._admitted),
+                "waiting": self._waiting,
+            }
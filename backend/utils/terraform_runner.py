@@ -1,33 +1,523 @@
 import os
+import re
 import json
+import codecs
+import asyncio
+import hashlib
 import shutil
-import subprocess
+import tempfile
+import signal
+import sys
+import threading
+import time
 import zipfile
 
+from utils.resources import ProcessTreeSampler
 
-def _run_terraform_outputs(job_dir: str, env: dict) -> dict:
+
+# How often a running command is checked for cancellation / timeout
+POLL_INTERVAL_SECONDS = 1
+
+# After SIGINT, Terraform gets this long to release locks and persist state
+# before it is terminated, and then killed.
+INTERRUPT_GRACE_SECONDS = 60
+TERMINATE_GRACE_SECONDS = 10
+
+# Terraform output is streamed from its pipe into the log in chunks of this size
+READ_CHUNK_BYTES = 64 * 1024
+
+# RSS / CPU of running terraform process trees, sampled every few seconds
+RESOURCE_SAMPLER = ProcessTreeSampler(interval_seconds=2.0)
+
+
+# Phases of an apply job, in order. A failed job can be resumed from any of them.
+APPLY_PHASES = ["init", "apply"]
+
+# Log lines that point at a temporary AWS / network / registry problem rather
+# than a broken configuration. Only failures matching these are auto-retried.
+TRANSIENT_ERROR_PATTERNS = [
+    "RequestLimitExceeded",
+    "ThrottlingException",
+    "Throttling: Rate exceeded",
+    "Rate exceeded",
+    "TooManyRequestsException",
+    "RequestTimeout",
+    "ServiceUnavailable",
+    "InternalError",
+    "InternalFailure",
+    "connection reset by peer",
+    "i/o timeout",
+    "TLS handshake timeout",
+    "context deadline exceeded",
+    "send request failed",
+    "Error acquiring the state lock",
+    "Failed to query available provider packages",
+    "could not connect to registry.terraform.io",
+]
+
+
+# Subset of the above that means "AWS is rate limiting this account / region".
+# Fed back into the concurrency governor.
+THROTTLING_ERROR_PATTERNS = [
+    "RequestLimitExceeded",
+    "ThrottlingException",
+    "Throttling: Rate exceeded",
+    "Rate exceeded",
+    "TooManyRequestsException",
+]
+
+
+def is_transient_failure(log_text: str) -> bool:
+    return any(pattern in log_text for pattern in TRANSIENT_ERROR_PATTERNS)
+
+
+def is_throttled(log_text: str) -> bool:
+    return any(pattern in log_text for pattern in THROTTLING_ERROR_PATTERNS)
+
+
+class JobControl:
+    """
+    Handle shared between the web app and a running Terraform job.
+
+    - timeouts: {phase: seconds} for "init" / "apply" / "output" / "destroy"
+    - cancel(): ask the running command to stop (SIGINT first, then escalate)
+    - outcome: None, "cancelled" or "timed_out" once the job was interrupted
+    - failed_phase / transient: which phase failed and whether its output
+      looked like a temporary error worth retrying
+    - parallelism: `-parallelism` for apply / destroy / plan (None = Terraform default)
+    - throttled: AWS throttling errors showed up in any phase's output
+    - phase_timings: one {phase, started_at, duration_seconds, exit_code}
+      per command run, in order (epoch seconds)
+    - rss_bytes / peak_rss_bytes / peak_cpu_percent / cpu_seconds: resource
+      usage of the terraform process trees (see utils.resources)
+    """
+
+    def __init__(self, timeouts: dict = None):
+        self.timeouts = timeouts or {}
+        self.outcome = None
+        self.phase = None
+        self.failed_phase = None
+        self.transient = False
+        self.parallelism = None
+        self.throttled = False
+        self.phase_timings = []
+        self.rss_bytes = 0
+        self.peak_rss_bytes = 0
+        self.peak_cpu_percent = 0.0
+        self.cpu_seconds = 0.0
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    async def await_cancel(self, seconds: float) -> bool:
+        """
+        Sleep up to `seconds` (e.g. retry backoff); returns True if cancelled meanwhile.
+        """
+        deadline = time.monotonic() + seconds
+        while not self.cancel_requested:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(POLL_INTERVAL_SECONDS, remaining))
+        return True
+
+
+# ---------------------------------------------------------------------------
+# Event loop
+#
+# Every Terraform process of this worker is driven by ONE asyncio loop running
+# in a background thread: output is read from non-blocking pipes and timeouts
+# / cancellation are checked by the loop, so no OS thread is parked on a
+# process for the length of an apply.
+#
+# The a*-prefixed coroutines below are the engine; the synchronous functions
+# with the original names are thin wrappers that submit them to the loop.
+# ---------------------------------------------------------------------------
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _use_pidfd_child_watcher(loop):
+    """
+    Python 3.11's default child watcher parks one thread per subprocess in
+    waitpid(); a pidfd watcher lets the loop itself notice exits instead.
+    3.12+ picks pidfd on its own. Only this loop starts subprocesses.
+    """
+    if sys.version_info >= (3, 12) or not hasattr(os, "pidfd_open"):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return  # kernel without pidfd support
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _use_pidfd_child_watcher(_loop)
+            threading.Thread(target=_loop.run_forever, name="terraform-runner", daemon=True).start()
+        return _loop
+
+
+def run_sync(coro):
+    """
+    Run a runner coroutine on the shared event loop and block until it finishes.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop()).result()
+
+
+def submit(coro):
+    """
+    Schedule a coroutine on the shared event loop and return at once with
+    its concurrent.futures.Future.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop())
+
+
+async def _interrupt_process(process, log_file):
+    """
+    Stop a Terraform process gracefully: SIGINT (Terraform saves state and
+    releases locks), then SIGTERM, then SIGKILL.
+    """
+    steps = [
+        ("SIGINT", INTERRUPT_GRACE_SECONDS),
+        ("SIGTERM", TERMINATE_GRACE_SECONDS),
+        ("SIGKILL", None),
+    ]
+    for name, grace in steps:
+        if process.returncode is not None:
+            return
+        log_file.write(f"\n>>> Sending {name} to terraform (pid {process.pid})\n")
+        log_file.flush()
+
+        try:
+            if name == "SIGINT" and os.name != "nt":
+                process.send_signal(signal.SIGINT)
+            elif name == "SIGKILL":
+                process.kill()
+            else:
+                process.terminate()
+        except ProcessLookupError:
+            return
+
+        try:
+            await asyncio.wait_for(process.wait(), grace)
+        except asyncio.TimeoutError:
+            continue
+
+
+async def _pump_output(stream, log_file, on_line=None):
+    """
+    Copy a process's output into log_file as it arrives (so /logs/stream sees
+    it live) and hand every complete line to on_line(line).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    partial = ""
+
+    while True:
+        chunk = await stream.read(READ_CHUNK_BYTES)
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            log_file.write(text)
+            log_file.flush()
+
+            if on_line is not None:
+                partial += text
+                *lines, partial = partial.split("\n")
+                for line in lines:
+                    on_line(line)
+                if len(partial) > READ_CHUNK_BYTES:
+                    on_line(partial)
+                    partial = ""
+        if not chunk:
+            break
+
+    if on_line is not None and partial:
+        on_line(partial)
+
+
+async def _supervise(process, phase: str, log_file, control: JobControl) -> int:
+    """
+    Wait for a process while enforcing control.timeouts[phase] and control.cancel().
+    """
+    control.phase = phase
+    timeout = control.timeouts.get(phase)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout else None
+
+    while True:
+        try:
+            return await asyncio.wait_for(process.wait(), POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+        if control.cancel_requested:
+            control.outcome = "cancelled"
+            log_file.write(f"\n>>> Cancellation requested during '{phase}'\n")
+        elif deadline is not None and loop.time() > deadline:
+            control.outcome = "timed_out"
+            log_file.write(f"\n>>> '{phase}' exceeded its timeout of {timeout}s\n")
+        else:
+            continue
+
+        await _interrupt_process(process, log_file)
+        return process.returncode if process.returncode else 1
+
+
+async def _run_command(
+    cmd: list, phase: str, job_dir: str, env: dict, log_file,
+    control: JobControl = None, on_line=None,
+) -> int:
+    """
+    Run one Terraform command with output streamed into log_file.
+
+    Honours control.timeouts[phase] and control.cancel(); when the command is
+    interrupted control.outcome is set and the (non-zero) exit code returned.
+    Cancelling the awaiting task also stops Terraform gracefully first.
+    """
+    started_at = time.time()
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=job_dir,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        env=env,
+    )
+    pump = asyncio.ensure_future(_pump_output(process.stdout, log_file, on_line))
+    RESOURCE_SAMPLER.track(process.pid, control)
+
+    try:
+        if control is None:
+            returncode = await process.wait()
+        else:
+            returncode = await _supervise(process, phase, log_file, control)
+    except asyncio.CancelledError:
+        if control is not None and control.outcome is None:
+            control.outcome = "cancelled"
+        log_file.write(f"\n>>> Runner task cancelled during '{phase}'\n")
+        await _interrupt_process(process, log_file)
+        raise
+    finally:
+        RESOURCE_SAMPLER.untrack(process.pid)
+        # A child that outlives terraform may hold the pipe open; don't wait on it forever
+        try:
+            await asyncio.wait_for(pump, TERMINATE_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+    if control is not None:
+        control.phase_timings.append({
+            "phase": phase,
+            "started_at": started_at,
+            "duration_seconds": round(time.time() - started_at, 3),
+            "exit_code": returncode,
+        })
+    return returncode
+
+
+# Phases whose command accepts -parallelism
+PARALLEL_PHASES = ("apply", "destroy", "drift")
+
+
+def _with_parallelism(cmd: list, phase: str, control: JobControl = None) -> list:
+    if control is None or not control.parallelism or phase not in PARALLEL_PHASES:
+        return cmd
+    return cmd + [f"-parallelism={control.parallelism}"]
+
+
+async def _run_phases(phases: list, job_dir: str, env: dict, log_file, control: JobControl = None) -> bool:
+    """
+    Run (phase, command) pairs in order, stopping at the first failure.
+    On failure control.failed_phase / control.transient describe what happened.
+    """
+    if control is not None:
+        control.failed_phase = None
+        control.transient = False
+
+    for phase, cmd in phases:
+        if control is not None and control.cancel_requested:
+            control.outcome = "cancelled"
+            control.failed_phase = phase
+            log_file.write(f"\nCancelled before '{phase}'\n")
+            log_file.flush()
+            return False
+
+        cmd = _with_parallelism(cmd, phase, control)
+        log_file.write(f">>> Running: {' '.join(cmd)}\n\n")
+        log_file.flush()
+
+        # Classify the phase's output while it streams instead of re-reading the log
+        seen = {"throttled": False, "transient": False}
+
+        def scan(line):
+            seen["throttled"] = seen["throttled"] or is_throttled(line)
+            seen["transient"] = seen["transient"] or is_transient_failure(line)
+
+        returncode = await _run_command(cmd, phase, job_dir, env, log_file, control, on_line=scan)
+
+        if control is not None:
+            control.throttled = control.throttled or seen["throttled"]
+
+        if returncode != 0:
+            if control is not None:
+                control.failed_phase = phase
+                control.transient = control.outcome is None and seen["transient"]
+            log_file.write(
+                f"\nCommand failed with exit code {returncode}\n"
+            )
+            log_file.flush()
+            return False
+
+    return True
+
+
+def _apply_phase_commands(from_phase: str = "init") -> list:
+    commands = {
+        "init": ["terraform", "init", "-input=false"],
+        "apply": ["terraform", "apply", "-auto-approve", "-input=false"],
+    }
+    start = APPLY_PHASES.index(from_phase)
+    return [(phase, commands[phase]) for phase in APPLY_PHASES[start:]]
+
+
+async def _run_terraform_outputs(job_dir: str, env: dict, control: JobControl = None) -> dict:
     """
     Helper: Run `terraform output -json` and return parsed dict.
     If command fails, returns {}.
     """
+    timeout = control.timeouts.get("output") if control else None
     try:
-        result = subprocess.run(
-            ["terraform", "output", "-json"],
+        process = await asyncio.create_subprocess_exec(
+            "terraform", "output", "-json",
             cwd=job_dir,
-            capture_output=True,
-            text=True,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
             env=env,
         )
-        if result.returncode != 0:
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return {}
+
+        if process.returncode != 0:
             return {}
-        if not result.stdout.strip():
+        if not stdout.strip():
             return {}
-        return json.loads(result.stdout)
+        return json.loads(stdout.decode("utf-8", errors="replace"))
     except Exception:
         return {}
 
 
-def run_terraform_template_job(
+def job_workspace_dir(job_id: int, job_mode: str, custom_jobs_root: str, base_dir: str) -> str:
+    """
+    Folder where a job's Terraform runs:
+        template mode -> infra/jobs/job_<id>/
+        custom mode   -> custom_jobs/job_<id>/
+    """
+    if job_mode == "template":
+        return os.path.join(base_dir, "..", "infra", "jobs", f"job_{job_id}")
+    return os.path.join(custom_jobs_root, f"job_{job_id}")
+
+
+# Written into a job workspace to point it at the engine's HTTP state backend.
+# Address and credentials come from TF_HTTP_* environment variables, so no
+# secret is ever written to disk.
+STATE_BACKEND_OVERRIDE_FILE = "cloudinfra_backend_override.tf"
+STATE_BACKEND_OVERRIDE = """# Generated by CloudInfra Deploy Engine – state is stored by the engine.
+terraform {
+  backend "http" {}
+}
+"""
+
+_BACKEND_BLOCK_RE = re.compile(r'^\s*backend\s+"', re.MULTILINE)
+
+
+def _defines_backend(job_dir: str) -> bool:
+    for name in os.listdir(job_dir):
+        if name.endswith(".tf") and name != STATE_BACKEND_OVERRIDE_FILE:
+            with open(os.path.join(job_dir, name), "r", encoding="utf-8", errors="replace") as f:
+                if _BACKEND_BLOCK_RE.search(f.read()):
+                    return True
+    return False
+
+
+def _configure_state_backend(job_dir: str, env: dict, state_backend: dict, inject: bool):
+    """
+    Point a workspace at the engine's HTTP state backend.
+
+    state_backend: TF_HTTP_* environment variables for this job (or None)
+    inject: write the backend override into the workspace. Otherwise the env
+            is only set if the workspace was already created with it.
+    """
+    if not state_backend:
+        return
+
+    override_path = os.path.join(job_dir, STATE_BACKEND_OVERRIDE_FILE)
+    if inject and not _defines_backend(job_dir):
+        with open(override_path, "w", encoding="utf-8") as f:
+            f.write(STATE_BACKEND_OVERRIDE)
+
+    if os.path.isfile(override_path):
+        env.update(state_backend)
+
+
+def _prepare_template_workspace(template_dir: str, job_dir: str, variables: dict):
+    # Fresh job dir
+    if os.path.exists(job_dir):
+        shutil.rmtree(job_dir)
+    shutil.copytree(template_dir, job_dir)
+
+    # TF vars
+    tfvars_path = os.path.join(job_dir, "terraform.auto.tfvars.json")
+    with open(tfvars_path, "w", encoding="utf-8") as f:
+        json.dump(variables, f, indent=2)
+
+
+def _extract_zip(zip_file_path: str, job_dir: str):
+    with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
+        zip_ref.extractall(job_dir)
+
+
+def _prepare_custom_workspace(zip_file_path: str, job_dir: str):
+    # Fresh job dir
+    if os.path.exists(job_dir):
+        shutil.rmtree(job_dir)
+    os.makedirs(job_dir, exist_ok=True)
+
+    _extract_zip(zip_file_path, job_dir)
+
+
+def _rebuild_template_workspace(job_dir: str, template_name: str, variables: dict, base_dir: str) -> bool:
+    """
+    Recreate a template job's workspace on a node that never ran it (or after
+    cleanup). Only meaningful when the state lives in the HTTP backend.
+    """
+    if not template_name or variables is None:
+        return False
+
+    template_dir = os.path.join(base_dir, "..", "infra", "templates", "aws", template_name)
+    if not os.path.isdir(template_dir):
+        return False
+
+    os.makedirs(os.path.dirname(job_dir), exist_ok=True)
+    _prepare_template_workspace(template_dir, job_dir, variables)
+    return True
+
+
+async def arun_terraform_template_job(
     job_id: int,
     template_name: str,
     variables: dict,
@@ -36,6 +526,8 @@ def run_terraform_template_job(
     aws_region: str,
     base_dir: str,
     logs_dir: str,
+    control: JobControl = None,
+    state_backend: dict = None,
 ):
     """
     Run a Terraform template for a specific job.
@@ -45,6 +537,8 @@ def run_terraform_template_job(
     - Runs `terraform init` and `terraform apply`
     - Captures logs in a log file
     - After success, runs `terraform output -json` and returns outputs dict
+    - Optional `control` applies per-phase timeouts and cancellation
+    - Optional `state_backend` (TF_HTTP_* env) stores state in the engine
 
     Returns:
         (success: bool, log_file_path: str | error_code, outputs: dict)
@@ -60,30 +554,19 @@ def run_terraform_template_job(
         return False, f"TEMPLATE_NOT_FOUND::{template_dir}", {}
 
     job_dir = os.path.join(jobs_root, f"job_{job_id}")
-
-    # Fresh job dir
-    if os.path.exists(job_dir):
-        shutil.rmtree(job_dir)
-    shutil.copytree(template_dir, job_dir)
+    await asyncio.to_thread(_prepare_template_workspace, template_dir, job_dir, variables)
 
     os.makedirs(logs_dir, exist_ok=True)
     log_file_path = os.path.join(logs_dir, f"job_{job_id}.log")
 
-    # TF vars
-    tfvars_path = os.path.join(job_dir, "terraform.auto.tfvars.json")
-    with open(tfvars_path, "w", encoding="utf-8") as f:
-        json.dump(variables, f, indent=2)
-
     # ENV
     env = os.environ.copy()
     env["AWS_ACCESS_KEY_ID"] = aws_access_key
     env["AWS_SECRET_ACCESS_KEY"] = aws_secret_key
     env["AWS_DEFAULT_REGION"] = aws_region
+    _configure_state_backend(job_dir, env, state_backend, inject=True)
 
-    commands = [
-        ["terraform", "init", "-input=false"],
-        ["terraform", "apply", "-auto-approve", "-input=false"],
-    ]
+    phases = _apply_phase_commands()
 
     with open(log_file_path, "w", encoding="utf-8") as log_file:
         log_file.write(f"Job #{job_id} - Template: {template_name}\n")
@@ -91,32 +574,44 @@ def run_terraform_template_job(
         log_file.write("-" * 60 + "\n\n")
         log_file.flush()
 
-        for cmd in commands:
-            log_file.write(f">>> Running: {' '.join(cmd)}\n\n")
-            log_file.flush()
-
-            process = subprocess.Popen(
-                cmd,
-                cwd=job_dir,
-                stdout=log_file,
-                stderr=subprocess.STDOUT,
-                env=env,
-            )
-            process.wait()
-
-            if process.returncode != 0:
-                log_file.write(
-                    f"\nCommand failed with exit code {process.returncode}\n"
-                )
-                log_file.flush()
-                return False, log_file_path, {}
+        if not await _run_phases(phases, job_dir, env, log_file, control):
+            return False, log_file_path, {}
 
     # If we reach here: apply success
-    outputs = _run_terraform_outputs(job_dir, env)
+    outputs = await _run_terraform_outputs(job_dir, env, control)
     return True, log_file_path, outputs
 
 
-def run_terraform_custom_job(
+def run_terraform_template_job(
+    job_id: int,
+    template_name: str,
+    variables: dict,
+    aws_access_key: str,
+    aws_secret_key: str,
+    aws_region: str,
+    base_dir: str,
+    logs_dir: str,
+    control: JobControl = None,
+    state_backend: dict = None,
+):
+    """
+    Blocking wrapper around arun_terraform_template_job() for thread-based callers.
+    """
+    return run_sync(arun_terraform_template_job(
+        job_id=job_id,
+        template_name=template_name,
+        variables=variables,
+        aws_access_key=aws_access_key,
+        aws_secret_key=aws_secret_key,
+        aws_region=aws_region,
+        base_dir=base_dir,
+        logs_dir=logs_dir,
+        control=control,
+        state_backend=state_backend,
+    ))
+
+
+async def arun_terraform_custom_job(
     job_id: int,
     zip_file_path: str,
     custom_jobs_root: str,
@@ -124,6 +619,8 @@ def run_terraform_custom_job(
     aws_secret_key: str,
     aws_region: str,
     logs_dir: str,
+    control: JobControl = None,
+    state_backend: dict = None,
 ):
     """
     Custom Mode runner:
@@ -133,6 +630,9 @@ def run_terraform_custom_job(
     - Runs `terraform init` and `terraform apply`
     - Captures logs in a log file
     - After success, runs `terraform output -json`
+    - Optional `control` applies per-phase timeouts and cancellation
+    - Optional `state_backend` stores state in the engine, unless the
+      project declares its own backend
 
     Returns:
         (success: bool, log_file_path: str | error_code, outputs: dict)
@@ -141,13 +641,8 @@ def run_terraform_custom_job(
     os.makedirs(custom_jobs_root, exist_ok=True)
     job_dir = os.path.join(custom_jobs_root, f"job_{job_id}")
 
-    if os.path.exists(job_dir):
-        shutil.rmtree(job_dir)
-    os.makedirs(job_dir, exist_ok=True)
-
     try:
-        with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
-            zip_ref.extractall(job_dir)
+        await asyncio.to_thread(_prepare_custom_workspace, zip_file_path, job_dir)
     except zipfile.BadZipFile:
         return False, "INVALID_ZIP_FILE", {}
 
@@ -158,11 +653,9 @@ def run_terraform_custom_job(
     env["AWS_ACCESS_KEY_ID"] = aws_access_key
     env["AWS_SECRET_ACCESS_KEY"] = aws_secret_key
     env["AWS_DEFAULT_REGION"] = aws_region
+    _configure_state_backend(job_dir, env, state_backend, inject=True)
 
-    commands = [
-        ["terraform", "init", "-input=false"],
-        ["terraform", "apply", "-auto-approve", "-input=false"],
-    ]
+    phases = _apply_phase_commands()
 
     with open(log_file_path, "w", encoding="utf-8") as log_file:
         log_file.write(f"Custom Job #{job_id}\n")
@@ -170,31 +663,41 @@ def run_terraform_custom_job(
         log_file.write("-" * 60 + "\n\n")
         log_file.flush()
 
-        for cmd in commands:
-            log_file.write(f">>> Running: {' '.join(cmd)}\n\n")
-            log_file.flush()
+        if not await _run_phases(phases, job_dir, env, log_file, control):
+            return False, log_file_path, {}
 
-            process = subprocess.Popen(
-                cmd,
-                cwd=job_dir,
-                stdout=log_file,
-                stderr=subprocess.STDOUT,
-                env=env,
-            )
-            process.wait()
+    outputs = await _run_terraform_outputs(job_dir, env, control)
+    return True, log_file_path, outputs
 
-            if process.returncode != 0:
-                log_file.write(
-                    f"\nCommand failed with exit code {process.returncode}\n"
-                )
-                log_file.flush()
-                return False, log_file_path, {}
 
-    outputs = _run_terraform_outputs(job_dir, env)
-    return True, log_file_path, outputs
+def run_terraform_custom_job(
+    job_id: int,
+    zip_file_path: str,
+    custom_jobs_root: str,
+    aws_access_key: str,
+    aws_secret_key: str,
+    aws_region: str,
+    logs_dir: str,
+    control: JobControl = None,
+    state_backend: dict = None,
+):
+    """
+    Blocking wrapper around arun_terraform_custom_job() for thread-based callers.
+    """
+    return run_sync(arun_terraform_custom_job(
+        job_id=job_id,
+        zip_file_path=zip_file_path,
+        custom_jobs_root=custom_jobs_root,
+        aws_access_key=aws_access_key,
+        aws_secret_key=aws_secret_key,
+        aws_region=aws_region,
+        logs_dir=logs_dir,
+        control=control,
+        state_backend=state_backend,
+    ))
 
 
-def run_terraform_destroy_job(
+async def arun_terraform_destroy_job(
     job_id: int,
     job_mode: str,
     template_name: str,
@@ -204,6 +707,9 @@ def run_terraform_destroy_job(
     aws_access_key: str,
     aws_secret_key: str,
     aws_region: str,
+    control: JobControl = None,
+    state_backend: dict = None,
+    variables: dict = None,
 ):
     """
     Runs `terraform destroy` for an existing job.
@@ -215,14 +721,21 @@ def run_terraform_destroy_job(
     For custom mode:
         folder = custom_jobs/job_<id>/
 
+    With `state_backend` + `variables`, a template job whose folder is missing
+    (other node, cleaned up) gets its workspace rebuilt from the template and
+    its state read from the engine.
+
     Returns:
         (success: bool, log_file_path: str)
     """
 
-    if job_mode == "template":
-        job_dir = os.path.join(base_dir, "..", "infra", "jobs", f"job_{job_id}")
-    else:
-        job_dir = os.path.join(custom_jobs_root, f"job_{job_id}")
+    job_dir = job_workspace_dir(job_id, job_mode, custom_jobs_root, base_dir)
+
+    rebuilt = False
+    if not os.path.isdir(job_dir) and state_backend and job_mode == "template":
+        rebuilt = await asyncio.to_thread(
+            _rebuild_template_workspace, job_dir, template_name, variables, base_dir,
+        )
 
     if not os.path.isdir(job_dir):
         return False, f"JOB_FOLDER_NOT_FOUND::{job_dir}"
@@ -234,31 +747,400 @@ def run_terraform_destroy_job(
     env["AWS_ACCESS_KEY_ID"] = aws_access_key
     env["AWS_SECRET_ACCESS_KEY"] = aws_secret_key
     env["AWS_DEFAULT_REGION"] = aws_region
+    _configure_state_backend(job_dir, env, state_backend, inject=rebuilt)
 
-    command = ["terraform", "destroy", "-auto-approve", "-input=false"]
+    phases = [("destroy", ["terraform", "destroy", "-auto-approve", "-input=false"])]
+    if not os.path.isdir(os.path.join(job_dir, ".terraform")):
+        phases.insert(0, ("init", ["terraform", "init", "-input=false"]))
 
     with open(log_file_path, "w", encoding="utf-8") as log_file:
         log_file.write(f"Destroy Job #{job_id}\n")
         log_file.write(f"Working Directory: {job_dir}\n")
+        if rebuilt:
+            log_file.write("Workspace rebuilt from template; state read from the engine\n")
         log_file.write("-" * 60 + "\n\n")
         log_file.flush()
 
-        log_file.write(f">>> Running: {' '.join(command)}\n\n")
+        if not await _run_phases(phases, job_dir, env, log_file, control):
+            log_file.write("\nDestroy FAILED\n")
+            return False, log_file_path
+
+    return True, log_file_path
+
+
+def run_terraform_destroy_job(
+    job_id: int,
+    job_mode: str,
+    template_name: str,
+    custom_jobs_root: str,
+    base_dir: str,
+    logs_dir: str,
+    aws_access_key: str,
+    aws_secret_key: str,
+    aws_region: str,
+    control: JobControl = None,
+    state_backend: dict = None,
+    variables: dict = None,
+):
+    """
+    Blocking wrapper around arun_terraform_destroy_job() for thread-based callers.
+    """
+    return run_sync(arun_terraform_destroy_job(
+        job_id=job_id,
+        job_mode=job_mode,
+        template_name=template_name,
+        custom_jobs_root=custom_jobs_root,
+        base_dir=base_dir,
+        logs_dir=logs_dir,
+        aws_access_key=aws_access_key,
+        aws_secret_key=aws_secret_key,
+        aws_region=aws_region,
+        control=control,
+        state_backend=state_backend,
+        variables=variables,
+    ))
+
+
+async def aresume_terraform_job(
+    job_id: int,
+    job_mode: str,
+    from_phase: str,
+    custom_jobs_root: str,
+    base_dir: str,
+    logs_dir: str,
+    aws_access_key: str,
+    aws_secret_key: str,
+    aws_region: str,
+    attempt: int = 2,
+    control: JobControl = None,
+    state_backend: dict = None,
+    template_name: str = None,
+    variables: dict = None,
+):
+    """
+    Re-run a failed job starting at `from_phase`, in its EXISTING workspace.
+
+    - Nothing is copied or extracted again; .terraform/ (providers, modules)
+      and any partial terraform.tfstate are reused
+    - `init` is only re-run if it was the failed phase or .terraform/ is missing
+    - Output is appended to the job's existing log file
+    - With `state_backend` + `template_name` + `variables`, a missing template
+      workspace is rebuilt and the partial state read from the engine
+
+    Returns:
+        (success: bool, log_file_path: str | error_code, outputs: dict)
+    """
+    job_dir = job_workspace_dir(job_id, job_mode, custom_jobs_root, base_dir)
+
+    rebuilt = False
+    if not os.path.isdir(job_dir) and state_backend and job_mode == "template":
+        rebuilt = await asyncio.to_thread(
+            _rebuild_template_workspace, job_dir, template_name, variables, base_dir,
+        )
+
+    if not os.path.isdir(job_dir):
+        return False, f"JOB_FOLDER_NOT_FOUND::{job_dir}", {}
+
+    if from_phase not in APPLY_PHASES:
+        from_phase = "init"
+    if not os.path.isdir(os.path.join(job_dir, ".terraform")):
+        from_phase = "init"
+
+    os.makedirs(logs_dir, exist_ok=True)
+    log_file_path = os.path.join(logs_dir, f"job_{job_id}.log")
+
+    env = os.environ.copy()
+    env["AWS_ACCESS_KEY_ID"] = aws_access_key
+    env["AWS_SECRET_ACCESS_KEY"] = aws_secret_key
+    env["AWS_DEFAULT_REGION"] = aws_region
+    _configure_state_backend(job_dir, env, state_backend, inject=rebuilt)
+
+    with open(log_file_path, "a", encoding="utf-8") as log_file:
+        log_file.write("\n" + "=" * 60 + "\n")
+        log_file.write(f"Retry attempt #{attempt} - resuming from '{from_phase}'\n")
+        log_file.write(f"Working directory: {job_dir}\n")
+        log_file.write("-" * 60 + "\n\n")
         log_file.flush()
 
-        process = subprocess.Popen(
-            command,
-            cwd=job_dir,
-            stdout=log_file,
-            stderr=subprocess.STDOUT,
-            env=env,
+        if not await _run_phases(_apply_phase_commands(from_phase), job_dir, env, log_file, control):
+            return False, log_file_path, {}
+
+    outputs = await _run_terraform_outputs(job_dir, env, control)
+    return True, log_file_path, outputs
+
+
+def resume_terraform_job(
+    job_id: int,
+    job_mode: str,
+    from_phase: str,
+    custom_jobs_root: str,
+    base_dir: str,
+    logs_dir: str,
+    aws_access_key: str,
+    aws_secret_key: str,
+    aws_region: str,
+    attempt: int = 2,
+    control: JobControl = None,
+    state_backend: dict = None,
+    template_name: str = None,
+    variables: dict = None,
+):
+    """
+    Blocking wrapper around aresume_terraform_job() for thread-based callers.
+    """
+    return run_sync(aresume_terraform_job(
+        job_id=job_id,
+        job_mode=job_mode,
+        from_phase=from_phase,
+        custom_jobs_root=custom_jobs_root,
+        base_dir=base_dir,
+        logs_dir=logs_dir,
+        aws_access_key=aws_access_key,
+        aws_secret_key=aws_secret_key,
+        aws_region=aws_region,
+        attempt=attempt,
+        control=control,
+        state_backend=state_backend,
+        template_name=template_name,
+        variables=variables,
+    ))
+
+
+# Lines of a refresh-only plan that name a resource changed outside Terraform
+_DRIFT_LINE_RE = re.compile(r"^\s*# (\S+) has (?:changed|been deleted)")
+
+
+async def arun_terraform_drift_check(
+    job_id: int,
+    job_mode: str,
+    template_name: str,
+    custom_jobs_root: str,
+    base_dir: str,
+    logs_dir: str,
+    aws_access_key: str,
+    aws_secret_key: str,
+    aws_region: str,
+    control: JobControl = None,
+    state_backend: dict = None,
+    variables: dict = None,
+):
+    """
+    Compare a live job against reality with
+    `terraform plan -refresh-only -detailed-exitcode`, in the job's existing
+    workspace (init only runs if .terraform/ is missing). Nothing is changed
+    and the state is not locked.
+
+    Returns:
+        (status: "in_sync" | "drifted" | "error", log_file_path: str, changed: list[str])
+    """
+    job_dir = job_workspace_dir(job_id, job_mode, custom_jobs_root, base_dir)
+
+    rebuilt = False
+    if not os.path.isdir(job_dir) and state_backend and job_mode == "template":
+        rebuilt = await asyncio.to_thread(
+            _rebuild_template_workspace, job_dir, template_name, variables, base_dir,
         )
-        process.wait()
 
-        if process.returncode != 0:
-            log_file.write(
-                f"\nDestroy FAILED with exit code {process.returncode}\n"
-            )
-            return False, log_file_path
+    if not os.path.isdir(job_dir):
+        return "error", f"JOB_FOLDER_NOT_FOUND::{job_dir}", []
 
-    return True, log_file_path
+    os.makedirs(logs_dir, exist_ok=True)
+    log_file_path = os.path.join(logs_dir, f"job_{job_id}_drift.log")
+
+    env = os.environ.copy()
+    env["AWS_ACCESS_KEY_ID"] = aws_access_key
+    env["AWS_SECRET_ACCESS_KEY"] = aws_secret_key
+    env["AWS_DEFAULT_REGION"] = aws_region
+    _configure_state_backend(job_dir, env, state_backend, inject=rebuilt)
+
+    command = [
+        "terraform", "plan", "-refresh-only", "-detailed-exitcode",
+        "-input=false", "-lock=false", "-no-color",
+    ]
+
+    with open(log_file_path, "w", encoding="utf-8") as log_file:
+        log_file.write(f"Drift Check Job #{job_id}\n")
+        log_file.write(f"Working Directory: {job_dir}\n")
+        log_file.write("-" * 60 + "\n\n")
+        log_file.flush()
+
+        if not os.path.isdir(os.path.join(job_dir, ".terraform")):
+            if not await _run_phases([("init", ["terraform", "init", "-input=false"])], job_dir, env, log_file, control):
+                return "error", log_file_path, []
+
+        command = _with_parallelism(command, "drift", control)
+        log_file.write(f">>> Running: {' '.join(command)}\n\n")
+        log_file.flush()
+
+        changed = []
+        throttled = []
+
+        def scan(line):
+            match = _DRIFT_LINE_RE.match(line)
+            if match:
+                changed.append(match.group(1))
+            if is_throttled(line):
+                throttled.append(line)
+
+        returncode = await _run_command(command, "drift", job_dir, env, log_file, control, on_line=scan)
+        if control is not None:
+            control.throttled = control.throttled or bool(throttled)
+
+    if returncode == 0:
+        return "in_sync", log_file_path, []
+    if returncode == 2:
+        return "drifted", log_file_path, changed
+    return "error", log_file_path, []
+
+
+def run_terraform_drift_check(
+    job_id: int,
+    job_mode: str,
+    template_name: str,
+    custom_jobs_root: str,
+    base_dir: str,
+    logs_dir: str,
+    aws_access_key: str,
+    aws_secret_key: str,
+    aws_region: str,
+    control: JobControl = None,
+    state_backend: dict = None,
+    variables: dict = None,
+):
+    """
+    Blocking wrapper around arun_terraform_drift_check() for thread-based callers.
+    """
+    return run_sync(arun_terraform_drift_check(
+        job_id=job_id,
+        job_mode=job_mode,
+        template_name=template_name,
+        custom_jobs_root=custom_jobs_root,
+        base_dir=base_dir,
+        logs_dir=logs_dir,
+        aws_access_key=aws_access_key,
+        aws_secret_key=aws_secret_key,
+        aws_region=aws_region,
+        control=control,
+        state_backend=state_backend,
+        variables=variables,
+    ))
+
+
+# ---------------------------------------------------------------------------
+# Pre-flight validation
+# ---------------------------------------------------------------------------
+
+# Never part of a configuration's content hash
+_HASH_SKIP_DIRS = {".terraform", ".git"}
+_HASH_SKIP_SUFFIXES = (".tfstate", ".tfstate.backup")
+
+
+def _hashed_file(rel_path: str) -> bool:
+    parts = rel_path.replace("\\", "/").split("/")
+    if any(part in _HASH_SKIP_DIRS for part in parts[:-1]):
+        return False
+    name = parts[-1]
+    return name != STATE_BACKEND_OVERRIDE_FILE and not name.endswith(_HASH_SKIP_SUFFIXES)
+
+
+def template_content_hash(template_dir: str) -> str:
+    """
+    sha256 over the relative paths + bytes of a template's files, so any
+    edit to the template gives a new hash. None if the folder is missing.
+    """
+    if not os.path.isdir(template_dir):
+        return None
+
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(template_dir):
+        dirs[:] = sorted(d for d in dirs if d not in _HASH_SKIP_DIRS)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, template_dir).replace(os.sep, "/")
+            if not _hashed_file(rel_path):
+                continue
+            digest.update(rel_path.encode() + b"\0")
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def zip_content_hash(zip_file_path: str) -> str:
+    """
+    Same as template_content_hash for an uploaded ZIP, computed over the
+    members (re-zipping the same files gives the same hash). None for a
+    broken archive.
+    """
+    digest = hashlib.sha256()
+    try:
+        with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
+            for info in sorted(zip_ref.infolist(), key=lambda i: i.filename):
+                if info.is_dir() or not _hashed_file(info.filename):
+                    continue
+                digest.update(info.filename.encode() + b"\0")
+                digest.update(hashlib.sha256(zip_ref.read(info)).digest())
+    except (zipfile.BadZipFile, OSError):
+        return None
+    return digest.hexdigest()
+
+
+async def avalidate_terraform_config(
+    job_id: int,
+    source: str,
+    logs_dir: str,
+    check_fmt: bool = False,
+    control: JobControl = None,
+):
+    """
+    Pre-flight check of a template folder or custom ZIP (`source`) in a
+    scratch copy: `terraform init -backend=false`, `terraform validate` and,
+    with check_fmt, `terraform fmt -check -recursive`.
+
+    Returns:
+        (validate_ok, fmt_ok, log_file_path) – validate_ok is None when no
+        verdict was reached (interrupted, or init hit a transient error);
+        fmt_ok is None when formatting was not checked.
+    """
+    control = control or JobControl()
+
+    os.makedirs(logs_dir, exist_ok=True)
+    log_file_path = os.path.join(logs_dir, f"job_{job_id}_validate.log")
+    scratch_dir = tempfile.mkdtemp(prefix=f"validate_job_{job_id}_")
+
+    try:
+        if os.path.isdir(source):
+            await asyncio.to_thread(shutil.copytree, source, scratch_dir, dirs_exist_ok=True)
+        else:
+            try:
+                await asyncio.to_thread(_extract_zip, source, scratch_dir)
+            except zipfile.BadZipFile:
+                return False, None, log_file_path
+
+        env = os.environ.copy()
+        env["TF_IN_AUTOMATION"] = "1"
+
+        with open(log_file_path, "w", encoding="utf-8") as log_file:
+            log_file.write(f"Pre-flight validation for Job #{job_id}\n")
+            log_file.write("-" * 60 + "\n\n")
+            log_file.flush()
+
+            init = [("preflight_init", ["terraform", "init", "-backend=false", "-input=false", "-no-color"])]
+            if not await _run_phases(init, scratch_dir, env, log_file, control):
+                decided = control.outcome is None and not control.transient
+                return (False if decided else None), None, log_file_path
+
+            validate = [("validate", ["terraform", "validate", "-no-color"])]
+            if not await _run_phases(validate, scratch_dir, env, log_file, control):
+                return (False if control.outcome is None else None), None, log_file_path
+
+            fmt_ok = None
+            if check_fmt:
+                fmt = [("fmt", ["terraform", "fmt", "-check", "-recursive", "-no-color"])]
+                fmt_ok = await _run_phases(fmt, scratch_dir, env, log_file, control)
+                if not fmt_ok and control.outcome is not None:
+                    return None, None, log_file_path
+
+            log_file.write("\nPre-flight validation passed\n")
+            return True, fmt_ok, log_file_path
+    finally:
+        await asyncio.to_thread(shutil.rmtree, scratch_dir, True)